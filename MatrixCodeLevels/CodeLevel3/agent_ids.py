@@ -0,0 +1,92 @@
+"""
+Agent ids.  Reads a slice of an agent ids file (one login_h per line) by
+seeking straight to its first line, instead of scanning the file from the
+start in every agent process.
+
+The byte offset of the start of every line is kept in an index file next to
+the agent ids file (<file>.idx: little-endian int64 offsets, one per line,
+followed by the file size), built with one pass over the file the first time
+it is needed and rebuilt when the agent ids file is newer or has a different
+size.  The index is memory-mapped, so a process only touches the two offsets
+of its slice.
+
+Build the index before starting the agent processes with:
+    python agent_ids.py agent_ids_file
+"""
+
+import os
+import sys
+import numpy as np
+from datetime import datetime
+from common import atomic_write
+
+
+# bytes of the agent ids file scanned at once while building the index
+scan_chunk = 1 << 24
+
+
+# line_offsets returns the offset of the start of each line of path, followed
+# by the size of the file.
+def line_offsets(path):
+    offsets = [np.zeros(1, dtype=np.int64)]
+    size = 0
+
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(scan_chunk)
+            if not chunk:
+                break
+
+            newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord("\n"))
+            offsets.append(size + newlines.astype(np.int64) + 1)
+            size += len(chunk)
+
+    offsets = np.concatenate(offsets)
+    if offsets[-1] != size:
+        offsets = np.append(offsets, size)  # last line has no newline
+
+    return offsets
+
+
+# load_line_offsets returns the memory-mapped index of path, building and
+# saving it first if there is none or it is out of date.  If the index cannot
+# be saved, it is returned from memory.
+def load_line_offsets(path):
+    index_path = f"{path}.idx"
+    st = os.stat(path)
+
+    try:
+        if os.stat(index_path).st_mtime_ns >= st.st_mtime_ns:
+            offsets = np.memmap(index_path, dtype="<i8", mode="r")
+            if len(offsets) > 0 and offsets[-1] == st.st_size:
+                return offsets
+    except (OSError, ValueError):
+        pass
+
+    timeA = datetime.now()
+    offsets = line_offsets(path)
+    print('\nindexed', len(offsets) - 1, 'agent ids in', str(datetime.now() - timeA))
+
+    atomic_write(index_path, offsets.astype("<i8").tofile, "agent ids index")
+
+    return offsets
+
+
+# read_agent_ids returns up to count agent ids from path, starting with the
+# one on line start (counting from 0).
+def read_agent_ids(path, start, count):
+    offsets = load_line_offsets(path)
+    num_lines = len(offsets) - 1
+
+    first = min(max(start, 0), num_lines)
+    last = min(first + max(count, 0), num_lines)
+
+    with open(path, 'rb') as f:
+        f.seek(int(offsets[first]))
+        data = f.read(int(offsets[last] - offsets[first]))
+
+    return [line.rstrip("\r\n") for line in data.decode().split("\n")[:last - first]]
+
+
+if __name__ == "__main__":
+    load_line_offsets(sys.argv[1])
@@ -0,0 +1,92 @@
+"""
+Agent Scheduler.  Hands out the agents of every round to the agent processes
+in chunks, from a counter shared by the processes, so that each process takes
+a new chunk as soon as it finishes one.  A process with slow agents (heavy
+event histories) then evaluates fewer of them instead of holding the round
+back, and the round's wall time is bounded by the total work rather than by
+the slowest fixed slice of the agent ids file.
+
+Every round has its own counter of the next agent to hand out, in one of two
+slots: round r uses slot r % 2.  A process resets the other slot, for round
+r + 1, when it starts round r.  This is safe because the controller starts a
+round only after every process has registered its events for the previous
+one: all processes are done with slot (r + 1) % 2 (round r - 1) before any
+resets it, and every reset happens before round r + 1 can start.
+
+The scheduler also collects the number of agents evaluated and the time spent
+by each process (worker), for report().
+"""
+
+import multiprocessing
+
+
+class AgentScheduler:
+    """
+    Chunks of agent positions (in the list of agent ids every process reads)
+    shared by num_workers processes.  Create it before starting the processes
+    and pass it to each of them.
+    """
+
+    def __init__(self, num_agents, num_workers, chunk_size=100):
+        self.num_agents = num_agents
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+
+        self.next_agent = multiprocessing.Array("q", 2)  # one slot per round parity
+        self.agents_done = multiprocessing.Array("q", num_workers)
+        self.busy_seconds = multiprocessing.Array("d", num_workers)
+
+    def start_round(self, round_num):
+        """
+        Reset the counter of the round after round_num.
+        """
+
+        with self.next_agent.get_lock():
+            self.next_agent[(round_num + 1) % 2] = 0
+
+    def claim(self, round_num):
+        """
+        Return the next chunk of agent positions of round_num as a range,
+        which is empty once all of the round's agents have been handed out.
+        """
+
+        slot = round_num % 2
+
+        with self.next_agent.get_lock():
+            start = self.next_agent[slot]
+            self.next_agent[slot] = start + self.chunk_size
+
+        return range(min(start, self.num_agents), min(start + self.chunk_size, self.num_agents))
+
+    def chunks(self, round_num):
+        """
+        Claim chunks of round_num until none are left.
+        """
+
+        while True:
+            chunk = self.claim(round_num)
+            if len(chunk) == 0:
+                return
+            yield chunk
+
+    def record(self, worker, num_agents, seconds):
+        """
+        Add num_agents evaluated in seconds to worker's totals.
+        """
+
+        with self.agents_done.get_lock():
+            self.agents_done[worker] += num_agents
+        with self.busy_seconds.get_lock():
+            self.busy_seconds[worker] += seconds
+
+    def report(self):
+        """
+        Print the agents evaluated, time spent and throughput of each worker.
+        """
+
+        print('\nworker     agents    seconds   agents/s')
+        for worker in range(self.num_workers):
+            agents = self.agents_done[worker]
+            seconds = self.busy_seconds[worker]
+            rate = agents / seconds if seconds > 0 else 0.0
+            print(f'{worker:6d} {agents:10d} {seconds:10.1f} {rate:10.1f}')
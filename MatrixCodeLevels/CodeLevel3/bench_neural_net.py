@@ -0,0 +1,64 @@
+"""
+Micro-benchmark of neural net inference latency through c_code2.
+
+Times n_agents inferences (default 10000) with random inputs:
+    before:  createNullExampleSet before every runCommonNeuralNet call, as
+             runCommonNeuralNet did until the example set was created once
+             in initCommonNeuralNet (each call makes Lens run echo in a shell)
+    after:   runCommonNeuralNet alone, overwriting the example set in place
+    batch:   one runCommonNeuralNetBatch call for all n_agents
+    forward: one runCommonNeuralNetForwardBatch call (no training)
+
+Usage:  python bench_neural_net.py [n_agents]
+"""
+
+import sys
+import time
+import numpy as np
+
+from _c_code2 import ffi, lib
+
+
+def random_input_strings(n):
+    inputs = np.random.random_sample((n, lib.N_INPUTS))
+    return [" ".join(str(x) for x in row).encode() for row in inputs]
+
+
+def time_calls(label, n, run):
+    timeA = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - timeA
+    print(f"{label:8s} {n} inferences in {seconds:.3f} s = {1e6 * seconds / n:.1f} us per inference")
+    return seconds
+
+
+def bench(n):
+    lib.initCommonNeuralNet()
+    strings = random_input_strings(n)
+
+    def before():
+        for s in strings:
+            lib.createNullExampleSet()
+            lib.runCommonNeuralNet(s)
+
+    def after():
+        for s in strings:
+            lib.runCommonNeuralNet(s)
+
+    def batch(run_batch):
+        inputs = np.random.random_sample((n, lib.N_INPUTS)).astype(np.float32)
+        outputs = np.zeros((n, lib.N_OUTPUTS), dtype=np.float32)
+        argmax = np.zeros(n, dtype=np.intc)
+        run_batch(ffi.from_buffer("float[]", inputs), n,
+                  ffi.from_buffer("float[]", outputs, require_writable=True),
+                  ffi.from_buffer("int[]", argmax, require_writable=True))
+
+    seconds_before = time_calls("before", n, before)
+    seconds_after = time_calls("after", n, after)
+    time_calls("batch", n, lambda: batch(lib.runCommonNeuralNetBatch))
+    time_calls("forward", n, lambda: batch(lib.runCommonNeuralNetForwardBatch))
+    print(f"speedup from creating the example set once: {seconds_before / seconds_after:.1f}x")
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,135 @@
+"""
+Round benchmark.  Runs full rounds of agent processes against a
+StubController in this process, on one machine, and reports the controller's
+per-round events/s and RPC handling times and each agent process's
+throughput.
+
+The agents are taken from the agent ids file (by default <db>.users, as
+written by make_synthetic_db.py) and handed out to the processes by an
+AgentScheduler, as in startMultiAgent.  The agent processes' output is
+discarded unless --verbose is given.
+
+Usage:  python bench_rounds.py gh.sqlite [--agent-ids FILE] [--agents N]
+            [--procs N] [--rounds N] [--chunk-size N] [--scorer lens|numpy]
+            [--workers N] [--pipelined] [--event-chunk-size N] [--store]
+            [--db-mode rw|ro|immutable] [--db-pragmas] [--stage memory|shm]
+            [--metrics-file FILE] [--verbose]
+
+--db-mode, --db-pragmas (the tuned pragmas of sqlite_connect) and --stage
+set how the agent processes open the database (see sqlite_connect).  A copy
+staged in /dev/shm is removed at the end.
+--metrics-file appends each process's per-round stage times (see
+stage_timers) to FILE as JSON lines.
+"""
+
+import os
+import sys
+import argparse
+import threading
+from datetime import datetime
+from multiprocessing import Process
+from multiprocessing.connection import wait
+
+from multi_agent_v7 import main_multi_agent
+from agent_scheduler import AgentScheduler
+from agent_ids import load_line_offsets
+from stub_controller import StubController
+from sqlite_connect import tuned
+from sqlite_connect import remove_staged_copies
+
+
+def run_agent(verbose, *args, **kwargs):
+    if not verbose:
+        sys.stdout = open(os.devnull, "w")
+        sys.stderr = open(os.devnull, "w")
+    main_multi_agent(*args, **kwargs)
+
+
+# wait_for_agents waits for the agent processes to exit and returns the
+# first that failed, as soon as one does (the others then wait for it at
+# the start of the next round), or None.
+def wait_for_agents(procs):
+    running = list(procs)
+    while running:
+        for sentinel in wait([proc.sentinel for proc in running]):
+            proc = next(proc for proc in running if proc.sentinel == sentinel)
+            proc.join()
+            if proc.exitcode != 0:
+                return proc
+            running.remove(proc)
+    return None
+
+
+def bench(args):
+    agent_ids_file = args.agent_ids or args.db + ".users"
+    num_agents = min(args.agents, len(load_line_offsets(agent_ids_file)) - 1)
+
+    controller = StubController(args.procs, args.rounds, 1501541900, 3600,
+                                args.db if args.store else None)
+    thread = threading.Thread(target=controller.serve, args=(0,), daemon=True)
+    thread.start()
+    controller.listening.wait()
+
+    scheduler = AgentScheduler(num_agents, args.procs, args.chunk_size)
+    db_options = dict(tuned if args.db_pragmas else {}, mode=args.db_mode, stage=args.stage)
+    agent_kwargs = {'scorer': args.scorer, 'num_workers': args.workers,
+                    'pipelined': args.pipelined, 'event_chunk_size': args.event_chunk_size,
+                    'scheduler': scheduler, 'stage_timing': args.metrics_file != None,
+                    'metrics_file': args.metrics_file, 'db_options': db_options}
+
+    timeA = datetime.now()
+    procs = []
+    for worker in range(args.procs):
+        proc = Process(target=run_agent,
+                       args=(args.verbose, f'127.0.0.1:{controller.port}', args.db,
+                             agent_ids_file, 0, num_agents),
+                       kwargs=dict(agent_kwargs, worker=worker))
+        procs.append(proc)
+        proc.start()
+
+    failed = wait_for_agents(procs)
+    if failed != None:
+        # the controller and the other agents would wait for it forever
+        controller.done.set()
+        for proc in procs:
+            proc.terminate()
+            proc.join()
+    thread.join()
+
+    if args.stage == "shm":
+        remove_staged_copies(args.db)
+
+    if failed != None:
+        print(f'\nagent process {procs.index(failed)} exited with code {failed.exitcode}'
+              + ('' if args.verbose else ' (rerun with --verbose to see its output)'))
+        sys.exit(1)
+
+    print(f'\n{num_agents} agents, {args.procs} processes, {args.rounds} rounds in',
+          str(datetime.now() - timeA))
+    controller.report()
+    scheduler.report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark full rounds against a stub controller.")
+    parser.add_argument("db")
+    parser.add_argument("--agent-ids", default=None)
+    parser.add_argument("--agents", type=int, default=1000)
+    parser.add_argument("--procs", type=int, default=2)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--chunk-size", type=int, default=100)
+    parser.add_argument("--scorer", choices=["lens", "numpy"], default="lens")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--pipelined", action="store_true")
+    parser.add_argument("--event-chunk-size", type=int, default=None)
+    parser.add_argument("--store", action="store_true",
+                        help="add the registered events to the database's event table")
+    parser.add_argument("--db-mode", choices=["rw", "ro", "immutable"], default="rw")
+    parser.add_argument("--db-pragmas", action="store_true")
+    parser.add_argument("--stage", choices=["memory", "shm"], default=None)
+    parser.add_argument("--metrics-file", default=None)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    if args.store and (args.db_mode == "immutable" or args.stage != None):
+        parser.error("--store adds events the agents would not see with an immutable or staged database")
+    bench(args)
@@ -0,0 +1,107 @@
+"""
+Benchmark of the RPC transports of rpc_transport.
+
+For each round size (number of events per register_events call, default
+1000, 10000 and 65000) and each transport, sends register_events calls with
+events like those made by agent_events to a local echo server over a socket
+pair, and reports the request size, calls/s and MB/s.  The first transport,
+"legacy", is the encoding RPCProxy used before rpc_transport: JSON with the
+default separators and a uuid4 id per call.
+
+Usage:  python bench_rpc.py [round_size ...]
+"""
+
+import sys
+import json
+import time
+import socket
+import threading
+from uuid import uuid4
+
+import rpc_transport
+from rpc_transport import Transport
+
+
+min_seconds = 1.0   # time each transport and round size for at least this long
+
+
+class LegacyJSONCodec(rpc_transport.JSONCodec):
+    name = "legacy"
+
+    def encode(self, msg):
+        msg = dict(msg, id=str(uuid4()))
+        return json.dumps(msg).encode("ascii")
+
+
+def make_events(n):
+    return [{
+        "id_h": f"{i:022x}_{7}",
+        "actor": {"login_h": f"{i:022x}"},
+        "repo": {"full_name_h": f"{i * 7919:022x}"},
+        "type": "PushEvent",
+        "created_at": "2017-08-01T01:23:45Z",
+        "_l_created_at": 7
+    } for i in range(n)]
+
+
+def serve(sock, transport):
+    # decode each request and answer it, as the controller does
+    fobj = sock.makefile(mode="rb")
+    while True:
+        request = transport.read_response(fobj)  # same decoding as a response
+        if request == None:
+            return
+        response = {"jsonrpc": "2.0", "id": request["id"], "result": True}
+        sock.sendall(transport.framing.frame(transport.codec.encode(response)))
+
+
+def transports():
+    legacy = Transport()
+    legacy.codec = LegacyJSONCodec()
+
+    yield ("legacy", legacy, Transport())
+    yield ("json/newline", Transport("json", "newline"), Transport("json", "newline"))
+    yield ("json/length", Transport("json", "length"), Transport("json", "length"))
+    if "msgpack" in rpc_transport.codecs:
+        yield ("msgpack/length", Transport("msgpack", "length"), Transport("msgpack", "length"))
+    else:
+        print("msgpack is not installed: not timed")
+
+
+def bench(round_sizes):
+    print(f"{'transport':15s} {'events':>7s} {'bytes/call':>11s} {'calls/s':>9s} {'MB/s':>8s}")
+
+    for n in round_sizes:
+        events = make_events(n)
+
+        for name, client_transport, server_transport in transports():
+            (client, server) = socket.socketpair()
+            thread = threading.Thread(target=serve, args=(server, server_transport), daemon=True)
+            thread.start()
+            fobj = client.makefile(mode="rb")
+
+            calls = 0
+            sent = 0
+            timeA = time.perf_counter()
+            while True:
+                (msg_id, msg) = client_transport.request("register_events", {"events": events})
+                client.sendall(msg)
+                client_transport.read_response(fobj)
+                calls += 1
+                sent += len(msg)
+
+                seconds = time.perf_counter() - timeA
+                if seconds >= min_seconds:
+                    break
+
+            fobj.close()
+            client.close()  # the server sees the end of the connection
+            thread.join()
+            server.close()
+
+            print(f"{name:15s} {n:7d} {sent // calls:11d} {calls / seconds:9.1f} "
+                  f"{sent / seconds / 2**20:8.1f}")
+
+
+if __name__ == "__main__":
+    bench([int(x) for x in sys.argv[1:]] or [1000, 10000, 65000])
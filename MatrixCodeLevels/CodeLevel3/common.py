@@ -1,6 +1,18 @@
+import os
+import calendar
+from datetime import datetime
+
 format = '%Y-%m-%dT%H:%M:%SZ'
 merge_period = 30  # number of days to be considered merged promptly
 
+#event types in order (the order of the neural net outputs):
+event_types = ["CreateEvent", "DeleteEvent", "ForkEvent", "IssuesEvent", "PullRequestEvent", "PushEvent", "WatchEvent", "IssueCommentEvent", "PullRequestReviewCommentEvent", "CommitCommentEvent"]
+
+# application_id of a working database written by working_db.py, in which
+# event types are stored as their index in event_types and times as integer
+# seconds since the epoch (UTC)
+working_db_id = 0x4D545258
+
 # str_is_number returns True if s is a number, otherwise False.
 # Also checks for None: str_is_number(None) = False
 
@@ -15,3 +27,58 @@ def str_is_number(s):
 
     return True
 
+# is_working_db returns True if con is a connection to a working database.
+
+def is_working_db(con):
+    (application_id,) = con.execute("pragma application_id").fetchone()
+    return application_id == working_db_id
+
+# parse_time returns the datetime of a time in format, or of integer seconds
+# since the epoch (a working database's times).  Raises an exception for
+# anything else.
+
+def parse_time(value):
+    if isinstance(value, int):
+        return datetime.utcfromtimestamp(value)
+    return datetime.strptime(value, format)
+
+# timestamp returns the integer seconds since the epoch of a time in format.
+
+def timestamp(dtstr):
+    return calendar.timegm(datetime.strptime(dtstr, format).timetuple())
+
+# atomic_write writes path with write(f), which writes the binary file f,
+# under a temporary name private to the process that is then renamed into
+# place: several agent processes may write the same file at once, and none
+# of them may read a partial one.  Prints a message naming what and returns
+# False if the file cannot be written.
+
+def atomic_write(path, write, what):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+        return True
+    except OSError as e:
+        print(f'\ncould not write {what}:', e)
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+
+# timestamp_sql returns the SQL expression converting column, a time in
+# format, to integer seconds since the epoch, or null if it is not a valid
+# time in format.
+
+def timestamp_sql(column):
+    return (f"case when strftime('{format}', {column}) = {column} "
+            f"then cast(strftime('%s', {column}) as integer) end")
+
+# type_index_sql returns the SQL expression converting column, an event type
+# name, to its index in event_types, or null if it is not one of them.
+
+def type_index_sql(column):
+    cases = " ".join(f"when '{etype}' then {i}" for i, etype in enumerate(event_types))
+    return f"case {column} {cases} end"
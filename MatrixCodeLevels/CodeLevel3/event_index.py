@@ -0,0 +1,162 @@
+"""
+Event Count Index.  Per-user, per-event-type index of event times, built once
+at agent start from the event table and extended as simulated events are
+registered, so that counting a user's events of each type in a time window is
+a lookup instead of a scan of the event table.
+
+For each user the index keeps one sorted int64 array of keys, a key for each
+of the user's events: the index of its type in event_types times type_stride
+plus its created_at in seconds since the epoch.  The events of each type are
+thus a sorted run of the array, and the position of a key in it is the
+running (prefix) count of events before it, so the counts of all types for a
+window [dt1, dt2) are the differences of two vectorized searchsorted calls.
+A key takes 8 bytes per event, against about 75 for a created_at string in a
+list.
+
+created_at strings are converted to seconds by SQLite as they are loaded
+(timestamp_sql in common.py); a working database (see working_db.py) stores
+types and times as integers already.  Events whose created_at is not in the
+format of common.py are left out: the created_at string comparisons of
+count_events in past_behavior_v5 may count some of them, and a working
+database drops them too.
+"""
+
+import numpy as np
+from datetime import datetime
+from common import event_types
+from common import is_working_db
+from common import timestamp
+from common import timestamp_sql
+from common import type_index_sql
+from feature_norm import type_position
+
+
+# seconds between the first keys of successive types (some 35,000 years)
+type_stride = 2 ** 40
+
+# first key of each type
+type_offsets = np.arange(len(event_types), dtype=np.int64) * type_stride
+
+
+# user_events_sql returns the query of the (type index, created_at seconds)
+# of a user's events, converted by SQLite unless working_db is set.
+def user_events_sql(working_db):
+    if working_db:
+        return """
+            select type, created_at
+            from event
+            where "actor.login_h" = ?
+            """
+
+    return f"""
+        select {type_index_sql('type')}, {timestamp_sql('created_at')}
+        from event
+        where "actor.login_h" = ?
+        """
+
+
+class EventCountIndex:
+    """
+    Sorted event keys (type and time) for each user.
+    """
+
+    def __init__(self):
+        self.keys = {}  # keys[user_id] = sorted int64 keys of the user's events
+
+    def __contains__(self, user_id):
+        return user_id in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def build(cls, con, user_ids):
+        """
+        Build the index for user_ids from the event table.
+        """
+
+        index = cls()
+
+        for user_id in user_ids:
+            index.add_user(con, user_id)
+
+        return index
+
+    def add_user(self, con, user_id):
+        """
+        (Re)load all events of user_id from the event table.
+        """
+
+        sql = user_events_sql(is_working_db(con))
+
+        # rows with an unknown type or a malformed created_at are never
+        # counted
+        rows = np.array([row for row in con.execute(sql, (user_id,))
+                         if isinstance(row[0], int) and isinstance(row[1], int)],
+                        dtype=np.int64).reshape(-1, 2)
+        rows = rows[(rows[:, 0] >= 0) & (rows[:, 0] < len(event_types))
+                    & (rows[:, 1] >= 0) & (rows[:, 1] < type_stride)]
+
+        keys = type_offsets[rows[:, 0]] + rows[:, 1]
+        keys.sort()
+
+        self.keys[user_id] = keys
+
+    def retain(self, user_ids):
+        """
+        Drop the users not in user_ids from the index.
+        """
+
+        user_ids = set(user_ids)
+        for user_id in [user_id for user_id in self.keys if user_id not in user_ids]:
+            del self.keys[user_id]
+
+    def add_events(self, events):
+        """
+        Add registered events (dicts as sent to register_events) for users
+        already in the index.
+        """
+
+        new_keys = {}  # user_id -> keys of the user's events
+
+        for event in events:
+            user_id = event["actor"]["login_h"]
+            etype = event["type"]
+
+            if user_id in self.keys and etype in type_position:
+                new_keys.setdefault(user_id, []).append(
+                    type_offsets[type_position[etype]] + timestamp(event["created_at"]))
+
+        # one insertion for each user (usually of a single event)
+        for user_id, user_keys in new_keys.items():
+            user_keys = np.sort(np.array(user_keys, dtype=np.int64))
+            keys = self.keys[user_id]
+            self.keys[user_id] = np.insert(keys, np.searchsorted(keys, user_keys), user_keys)
+
+    def count_seconds(self, bounds, user_id):
+        """
+        Return an int64 array of shape (len(bounds), len(event_types)): the
+        number of events of each type with t1 <= created_at < t2 for
+        user_id, for each (t1, t2) of bounds in seconds since the epoch.
+        """
+
+        bounds = np.array(bounds, dtype=np.int64).reshape(-1, 2, 1)
+        positions = np.searchsorted(self.keys[user_id], type_offsets + bounds)
+        return positions[:, 1] - positions[:, 0]
+
+    def count(self, dtstr1, dtstr2, user_id):
+        """
+        Return dictionary of number of events of each type with
+        dtstr1 <= created_at < dtstr2 for user_id.
+        """
+
+        (counts,) = self.count_seconds([(timestamp(dtstr1), timestamp(dtstr2))], user_id)
+        return {etype: int(n) for etype, n in zip(event_types, counts)}
+
+
+def build_event_index(con, user_ids):
+    timeA = datetime.now()
+    index = EventCountIndex.build(con, user_ids)
+    timeB = datetime.now()
+    print('\ntime to build event count index for', len(index), 'users =', str(timeB-timeA))
+    return index
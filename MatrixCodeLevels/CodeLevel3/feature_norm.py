@@ -0,0 +1,196 @@
+"""
+Feature normalization.  Log-scaled normalization of counts and of past
+behavior deltas to [0, 1], for the neural net inputs.
+
+normalize_count and normalize_delta normalize one value.  Normalizer applies
+the same log-clip-scale to every column of an (agents x features) matrix at
+once, with the bounds of each column from a bounds table and their logs
+computed once.  raw_feature_values reads the count and group role columns of
+a user_ext or repo_ext row before normalization.
+
+Run this file to check that Normalizer gives the same values as the scalar
+functions (to within rounding of the last bit of a log).
+"""
+
+import sys
+import numpy as np
+from math import log
+from common import event_types
+
+
+# position of each event type in the past behavior inputs and neural net
+# outputs
+type_position = {etype: i for i, etype in enumerate(event_types)}
+
+
+# count_value returns a count column's value as a float.  Raises an
+# exception if it is not a number.
+def count_value(value):
+    if not isinstance(value, (int, float)):
+        raise TypeError("count is not a number")
+    return float(value)
+
+
+# group_role returns a group role column's value as a float: 0 for a user or
+# repo not in the group_roles table (null values).  Raises an exception if
+# it is not a number.
+def group_role(value):
+    if value == None:  # not in group_roles table
+        return 0.0
+    return float(value)  # not a number: exception
+
+
+# raw_feature_values returns the counts and then the group roles of a row,
+# before normalization, as a list of floats.  Raises an exception if the row
+# is invalid.
+def raw_feature_values(counts, group_roles):
+    return [count_value(value) for value in counts] + [group_role(value) for value in group_roles]
+
+
+def normalize_count(data, dmin, dmax):
+    if data == 0:
+        data = 1
+    data = log(data)
+
+    if dmin == 0:
+        dmin = 1
+    dmin = log(dmin) 
+
+    if dmax == 0:
+        dmax = 1
+    dmax = log(dmax) 
+
+    if data < dmin:
+        data = dmin
+
+    if data > dmax:
+        data = dmax
+
+    return (data - dmin) / (dmax - dmin)
+
+def normalize_delta(data, dmin, dmax):
+    data = log(data + 2.0)
+    dmin = log(dmin + 2.0) 
+    dmax = log(dmax + 2.0) 
+
+    if data < dmin:
+        data = dmin
+
+    if data > dmax:
+        data = dmax
+
+    return (data - dmin) / (dmax - dmin)
+
+
+# Bounds tables: (feature, dmin, dmax) for each column, in neural net input order.
+
+user_count_bounds = [("public_repos", 0.0, 132125.0),
+                     ("followers",    0.0, 20238.0),
+                     ("following",    0.0, 24604.0),
+                     ("PendNbrs",     0.0, 169481.0),
+                     ("inG2deg",      0.0, 169569.0),
+                     ("inG1deg",      0.0, 169569.0)]
+
+repo_count_bounds = [("watchers_count",    0.0, 291574.0),
+                     ("forks_count",       0.0, 107293.0),
+                     ("issue.open_count",  0.0, 51903.0),
+                     ("issue.total_count", 0.0, 51903.0),
+                     ("PendNbrs",          0.0, 2776.0),
+                     ("inG2deg",           0.0, 40876.0),
+                     ("inG1deg",           0.0, 97415.0)]
+
+# past_behavior_delta metrics for each event type
+delta_bounds = list(zip(event_types,
+                        [-1.0] * len(event_types),
+                        [32964.0, 2544.17, 1781.0, 8189.0, 3528.0, 12235.67, 2074.4, 615.5, 141.0, 136.35]))
+
+# past_behavior_alpha counts for each event type
+alpha_bounds = list(zip(event_types,
+                        [0.0] * len(event_types),
+                        [143008.0, 75741.0, 22283.0, 28526.0, 43254.0, 2034093.0, 32962.0, 92571.0, 62128.0, 4303.0]))
+
+
+class Normalizer:
+    """
+    normalize_count (or normalize_delta, if delta is set) of each column of
+    a matrix, column j with the bounds in bounds[j].
+    """
+
+    def __init__(self, bounds, delta=False):
+        self.names = [name for (name, dmin, dmax) in bounds]
+        self.delta = delta
+
+        self.dmin = dmin = np.array([dmin for (name, dmin, dmax) in bounds], dtype=np.float64)
+        self.dmax = dmax = np.array([dmax for (name, dmin, dmax) in bounds], dtype=np.float64)
+
+        if delta:
+            self.log_min = np.log(dmin + 2.0)
+            self.log_max = np.log(dmax + 2.0)
+        else:
+            self.log_min = np.log(np.where(dmin == 0, 1.0, dmin))
+            self.log_max = np.log(np.where(dmax == 0, 1.0, dmax))
+
+        self.log_range = self.log_max - self.log_min
+
+    def columns(self, names):
+        """
+        Return the positions in names of the columns this normalizes.
+        """
+
+        return [names.index(name) for name in self.names]
+
+    def __call__(self, data):
+        """
+        Return the normalized float64 (agents x features) matrix for data, a
+        matrix (or a single row) of raw values.  A value the scalar function
+        cannot take the log of (a negative count) gives nan.
+        """
+
+        data = np.asarray(data, dtype=np.float64)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if self.delta:
+                data = np.log(data + 2.0)
+            else:
+                data = np.log(np.where(data == 0, 1.0, data))
+
+        return (np.clip(data, self.log_min, self.log_max) - self.log_min) / self.log_range
+
+
+normalize_user_counts = Normalizer(user_count_bounds)
+normalize_repo_counts = Normalizer(repo_count_bounds)
+normalize_deltas = Normalizer(delta_bounds, delta=True)
+normalize_alphas = Normalizer(alpha_bounds)
+
+
+# check_normalizer returns the largest difference between normalizer and the
+# scalar function, over n random rows with values from below each column's
+# lower bound to above its upper bound (and some zeros).
+def check_normalizer(normalizer, n=10000):
+    scalar = normalize_delta if normalizer.delta else normalize_count
+
+    data = np.random.random_sample((n, len(normalizer.names))) * (1.5 * normalizer.dmax + 2.0)
+    if normalizer.delta:
+        data -= 1.0
+    data[np.random.random_sample(data.shape) < 0.1] = 0.0
+
+    expected = np.array([[scalar(data[i, j], normalizer.dmin[j], normalizer.dmax[j])
+                          for j in range(data.shape[1])]
+                         for i in range(n)])
+
+    return float(np.abs(normalizer(data) - expected).max())
+
+
+if __name__ == "__main__":
+    failed = False
+
+    for label, normalizer in [("user counts", normalize_user_counts),
+                              ("repo counts", normalize_repo_counts),
+                              ("deltas", normalize_deltas),
+                              ("alphas", normalize_alphas)]:
+        max_diff = check_normalizer(normalizer)
+        print(f"{label}: largest difference from scalar function = {max_diff}")
+        failed = failed or max_diff > 1e-12
+
+    if failed:
+        sys.exit(1)
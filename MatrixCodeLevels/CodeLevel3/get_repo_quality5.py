@@ -9,30 +9,17 @@ from datetime import datetime
 from datetime import timedelta
 from common import format
 from common import merge_period
+from common import parse_time
 from uuid import uuid4
 
 
-def get_fraction_merged_for_users_and_repos(con):
-
-    user_data = {}
-    repo_data = {}
-
-    fraction_merged_for_users = {} # fraction merged dictionary for each user who made a pull request
-    fraction_merged_for_repos = {} # fraction merged dictionary for each repo with a pull request
-    cur = con.cursor()
-
-    sql = """
-        select "user.login_h", "base.repo.full_name_h", merged, created_at, merged_at
-        from pr_state
-        where state = "closed"
-        """
-    cur.execute(sql)
-
-    while True:
-        row = cur.fetchone()
-        if row == None:
-            break
+# tally_merged_for_users_and_repos adds closed pull request rows
+# ("user.login_h", "base.repo.full_name_h", merged, created_at, merged_at)
+# to the [merged count, non-merged count] lists in user_data and repo_data.
+# The times are in format, or integer seconds in a working database.
+def tally_merged_for_users_and_repos(rows, user_data, repo_data):
 
+    for row in rows:
         try:
             user, repo, merged, created_at, merged_at = row
 
@@ -47,8 +34,8 @@ def get_fraction_merged_for_users_and_repos(con):
 #               repo_data[repo] [1] is non-merged count for this repo
 
             if merged:
-                dt_created_at = datetime.strptime(created_at, format)
-                dt_merged_at  = datetime.strptime(merged_at,  format)
+                dt_created_at = parse_time(created_at)
+                dt_merged_at  = parse_time(merged_at)
                 time_to_merge = dt_merged_at - dt_created_at
 
                 if time_to_merge <= timedelta(days=merge_period):
@@ -69,19 +56,66 @@ def get_fraction_merged_for_users_and_repos(con):
         except:
             continue  # go on to next row if bad data (e.g. bad date format)
 
-    for user in user_data.keys():
+
+# tally_commented_for_users adds issue rows ("user.login_h", state, comments)
+# to the [twice commented count, other count] lists in user_data.
+def tally_commented_for_users(rows, user_data):
+
+    for row in rows:
         try:
-            fraction_merged_for_users[user] = float(user_data[user][0]) / (user_data[user][0] + user_data[user][1])
-#           print(user, fraction_merged_for_users[user])
+            user, state, num_comments = row
+        
+            if not(user in user_data):
+                user_data[user] = [0,0]
+#               user_data[user] [0] is count of twice commented issues for this user
+#               user_data[user] [1] is count of other issues for this user
+
+            if int(num_comments) >= 2:
+                user_data[user][0] += 1
+            else:
+                user_data[user][1] += 1
         except:
             continue
 
+
+# fraction_of_first_count returns counts[0] / (counts[0] + counts[1])
+# for a [count, count] list, or None if both counts are 0.
+def fraction_of_first_count(counts):
+    try:
+        return float(counts[0]) / (counts[0] + counts[1])
+    except:
+        return None
+
+
+def get_fraction_merged_for_users_and_repos(con):
+
+    user_data = {}
+    repo_data = {}
+
+    fraction_merged_for_users = {} # fraction merged dictionary for each user who made a pull request
+    fraction_merged_for_repos = {} # fraction merged dictionary for each repo with a pull request
+    cur = con.cursor()
+
+    sql = """
+        select "user.login_h", "base.repo.full_name_h", merged, created_at, merged_at
+        from pr_state
+        where state = "closed"
+        """
+    cur.execute(sql)
+
+    tally_merged_for_users_and_repos(cur, user_data, repo_data)
+
+    for user in user_data.keys():
+        fraction = fraction_of_first_count(user_data[user])
+        if fraction is not None:
+            fraction_merged_for_users[user] = fraction
+#           print(user, fraction_merged_for_users[user])
+
     for repo in repo_data.keys():
-        try:
-            fraction_merged_for_repos[repo] = float(repo_data[repo][0]) / (repo_data[repo][0] + repo_data[repo][1])
+        fraction = fraction_of_first_count(repo_data[repo])
+        if fraction is not None:
+            fraction_merged_for_repos[repo] = fraction
 #           print(repo, fraction_merged_for_repos[repo])
-        except:
-            continue
 
     return (fraction_merged_for_users, fraction_merged_for_repos)
 
@@ -99,37 +133,26 @@ def get_fraction_of_issues_commented_for_users(con):
         """
     cur.execute(sql)
 
-    while True:
-        row = cur.fetchone()
-        if row == None:
-            break
-
-        try:
-            user, state, num_comments = row
-        
-            if not(user in user_data):
-                user_data[user] = [0,0]
-#               user_data[user] [0] is count of twice commented issues for this user
-#               user_data[user] [1] is count of other issues for this user
-
-            if int(num_comments) >= 2:
-                user_data[user][0] += 1
-            else:
-                user_data[user][1] += 1
-        except:
-            continue
+    tally_commented_for_users(cur, user_data)
 
     for user in user_data.keys():
-        try:
-            fraction_commented_for_users[user] = float(user_data[user][0]) / (user_data[user][0] + user_data[user][1])
+        fraction = fraction_of_first_count(user_data[user])
+        if fraction is not None:
+            fraction_commented_for_users[user] = fraction
             print('\nget_fraction_of_issues_commented_for_users:')
             print(user, fraction_commented_for_users[user])
-        except:
-            continue
 
     return fraction_commented_for_users
 
 
+# repo_pr_users_sql selects the users of all pull requests on a repo.
+
+repo_pr_users_sql = """
+    select "user.login_h"
+    from pr_state
+    where "base.repo.full_name_h" = ?
+    """
+
 # fraction_merged_for_users = dict of fraction of all pull requests merged
 # for each user referenced by pr_state, which defines the user qualities.
 
@@ -139,12 +162,7 @@ def get_repo_quality(con, repo_id, fraction_merged_for_users):
 
     user_quality = {}
 
-    sql = """
-        select "user.login_h"
-        from pr_state
-        where "base.repo.full_name_h" = ?
-        """
-    cur.execute(sql, (repo_id,)) # get all users who made a PR on this repo
+    cur.execute(repo_pr_users_sql, (repo_id,)) # get all users who made a PR on this repo
 
     while True:
         row = cur.fetchone()
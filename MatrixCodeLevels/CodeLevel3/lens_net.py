@@ -0,0 +1,137 @@
+"""
+Lens Net.  Forward pass of the common neural net in NumPy, with the weights
+read directly from a Lens binary weight file, so that all agents of a round
+can be scored with two matrix multiplies instead of one Lens call per agent.
+
+The net is the one built by initCommonNeuralNet in c_code2: an input group,
+a logistic hidden group and a logistic output group, each non-input unit
+with a bias link.  orr.2000.wt is 45-100-10; CodeLevel1's
+examples_350K_Random.wt is 17-100-7.
+
+Lens binary weight file layout (all values big-endian, 4 bytes each):
+    int    cookie (0x55555556)
+    int    number of links
+    int    values saved per link (1 = weight only, more = weight followed
+           by training state such as the last weight change)
+    int    number of weight updates the net had when saved
+    float  values per link for each link
+Links are in Lens order: for the hidden group and then the output group,
+for each unit, the link from the bias unit followed by the links from each
+unit of the group below.
+
+Run this file to check it against the Lens outputs:
+    python lens_net.py [weight_file n_inputs n_hidden n_outputs]
+"""
+
+import sys
+import numpy as np
+
+
+BINARY_WEIGHT_COOKIE = 0x55555556
+
+weights_file = "orr.2000.wt"
+N_INPUTS = 45
+N_HIDDEN = 100
+N_OUTPUTS = 10
+
+
+class LensWeightError(Exception):
+    pass
+
+
+def logistic(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+class LensNet:
+    """
+    Weights of an n_inputs - n_hidden - n_outputs Lens net.
+    """
+
+    def __init__(self, path=weights_file, n_inputs=N_INPUTS, n_hidden=N_HIDDEN,
+                 n_outputs=N_OUTPUTS):
+        self.n_inputs = n_inputs
+        self.n_hidden = n_hidden
+        self.n_outputs = n_outputs
+
+        data = np.fromfile(path, dtype=">i4")
+        if len(data) < 4 or data[0] != BINARY_WEIGHT_COOKIE:
+            raise LensWeightError(f"{path} is not a Lens binary weight file")
+
+        (num_links, values_per_link, self.total_updates) = (int(x) for x in data[1:4])
+
+        expected_links = n_hidden * (1 + n_inputs) + n_outputs * (1 + n_hidden)
+        if num_links != expected_links:
+            raise LensWeightError(f"{path} has {num_links} links, a {n_inputs}-{n_hidden}-{n_outputs} "
+                                  f"net has {expected_links}")
+        if len(data) != 4 + num_links * values_per_link:
+            raise LensWeightError(f"{path} is truncated")
+
+        # the weight is the first value saved for each link
+        weights = data[4:].view(">f4").reshape(num_links, values_per_link)[:, 0]
+        weights = weights.astype(np.float32)
+
+        hidden = weights[:n_hidden * (1 + n_inputs)].reshape(n_hidden, 1 + n_inputs)
+        output = weights[n_hidden * (1 + n_inputs):].reshape(n_outputs, 1 + n_hidden)
+
+        # stored as (inputs x units) so that a batch is inputs @ w + b
+        self.b_hidden = np.ascontiguousarray(hidden[:, 0])
+        self.w_hidden = np.ascontiguousarray(hidden[:, 1:].T)
+        self.b_output = np.ascontiguousarray(output[:, 0])
+        self.w_output = np.ascontiguousarray(output[:, 1:].T)
+
+    def forward(self, inputs):
+        """
+        Return the N x n_outputs outputs for N rows of inputs.
+        """
+
+        inputs = np.asarray(inputs, dtype=np.float32).reshape(-1, self.n_inputs)
+        hidden = logistic(inputs @ self.w_hidden + self.b_hidden)
+        return logistic(hidden @ self.w_output + self.b_output)
+
+    def run(self, inputs):
+        """
+        Return (outputs, index of the largest output of each row), like
+        runCommonNeuralNetForwardBatch.
+        """
+
+        outputs = self.forward(inputs)
+        return (outputs, outputs.argmax(axis=1).astype(np.intc))
+
+
+# check_against_lens scores n random inputs with both Lens (forward pass
+# only, through c_code2) and LensNet and returns the largest difference
+# between their outputs.
+def check_against_lens(net, n=1000):
+    from _c_code2 import ffi, lib
+
+    lib.initCommonNeuralNet()
+
+    inputs = np.random.random_sample((n, net.n_inputs)).astype(np.float32)
+    lens_outputs = np.zeros((n, net.n_outputs), dtype=np.float32)
+    lens_argmax = np.zeros(n, dtype=np.intc)
+
+    lib.runCommonNeuralNetForwardBatch(ffi.from_buffer("float[]", inputs), n,
+                                       ffi.from_buffer("float[]", lens_outputs, require_writable=True),
+                                       ffi.from_buffer("int[]", lens_argmax, require_writable=True))
+
+    (outputs, argmax) = net.run(inputs)
+
+    print('argmax agrees for', int((argmax == lens_argmax).sum()), 'of', n, 'examples')
+    return float(np.abs(outputs - lens_outputs).max())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5:
+        net = LensNet(sys.argv[1], *(int(x) for x in sys.argv[2:]))
+    else:
+        net = LensNet()
+
+    print(f'{net.n_inputs}-{net.n_hidden}-{net.n_outputs} net, saved after',
+          net.total_updates, 'updates')
+
+    if net.n_inputs == N_INPUTS and net.n_outputs == N_OUTPUTS:
+        max_diff = check_against_lens(net)
+        print('largest difference from Lens outputs:', max_diff)
+        if max_diff > 1e-4:
+            sys.exit(1)
@@ -0,0 +1,163 @@
+"""
+Synthetic event database.  Writes a gh.sqlite with the tables the agents read
+(event, user_ext, repo_ext, pr_state and issue_state, with the columns the
+GitHub store has), filled with random data at a chosen scale, and an agent
+ids file with the login_h of every user, for running and benchmarking rounds
+without the real data.
+
+Users' and repos' activity is heavy-tailed (a few users make most events and
+a few repos get most of them), as in the GitHub data.  About one group role
+value in five is null, as for users and repos not in the group_roles table.
+Event times are spread over the days_of_history days before the default
+start_time of startController.sh.
+
+Usage:  python make_synthetic_db.py gh.sqlite [--users N] [--repos N]
+            [--events-per-user N] [--prs N] [--issues N] [--seed N]
+"""
+
+import os
+import argparse
+import sqlite3
+import numpy as np
+from datetime import datetime
+from common import event_types
+
+
+start_time = 1501541900   # startController.sh start_time
+days_of_history = 120
+
+# rows generated and inserted at once
+insert_chunk = 100000
+
+
+def hashes(prefix, n):
+    # login_h and full_name_h look like the store's hashed names
+    return [f"{prefix}{i:021x}" for i in range(n)]
+
+
+def times(rng, n):
+    seconds = rng.integers(start_time - days_of_history * 86400, start_time, n)
+    return [datetime.utcfromtimestamp(int(t)).strftime('%Y-%m-%dT%H:%M:%SZ') for t in seconds]
+
+
+def heavy_tailed_choice(rng, n, size):
+    # index i chosen with probability proportional to 1 / (i + 1)
+    weights = 1.0 / np.arange(1, n + 1)
+    return rng.choice(n, size=size, p=weights / weights.sum())
+
+
+def group_roles(rng, n):
+    # PendNbrs, pendant, inG2deg, inG1deg, pTiesIngG1, ptiesingg2, isHub
+    columns = [rng.integers(0, 100, n), rng.integers(0, 2, n), rng.integers(0, 50, n),
+               rng.integers(0, 50, n), rng.random(n), rng.random(n), rng.integers(0, 2, n)]
+    rows = [[value.item() for value in row] for row in zip(*columns)]
+
+    for row, null in zip(rows, rng.random((n, len(columns))) < 0.2):
+        for j in np.flatnonzero(null):
+            row[j] = None
+
+    return rows
+
+
+def create_tables(con):
+    con.executescript("""
+        create table event (id_h text, type text, "actor.login_h" text,
+                            "repo.full_name_h" text, created_at text);
+        create table user_ext (login_h text, public_repos integer, followers integer,
+                               following integer, PendNbrs, pendant, inG2deg, inG1deg,
+                               pTiesIngG1, ptiesingg2, isHub);
+        create table repo_ext (full_name_h text, watchers_count integer, forks_count integer,
+                               "issue.open_count" integer, "issue.total_count" integer,
+                               PendNbrs, pendant, inG2deg, inG1deg,
+                               pTiesIngG1, ptiesingg2, isHub);
+        create table pr_state ("user.login_h" text, "base.repo.full_name_h" text,
+                               state text, merged integer, created_at text, merged_at text);
+        create table issue_state ("user.login_h" text, state text, comments integer);
+        """)
+
+
+def make_db(path, num_users, num_repos, events_per_user, num_prs, num_issues, seed=1):
+    timeA = datetime.now()
+    rng = np.random.default_rng(seed)
+
+    con = sqlite3.connect(path)
+    create_tables(con)
+
+    users = hashes("u", num_users)
+    repos = hashes("r", num_repos)
+
+    for start in range(0, num_users, insert_chunk):
+        n = min(insert_chunk, num_users - start)
+        counts = rng.pareto(1.5, (n, 3)) * [20, 20, 10]
+        con.executemany("insert into user_ext values (?,?,?,?,?,?,?,?,?,?,?)",
+                        [[user] + [int(x) for x in count] + roles
+                         for user, count, roles in zip(users[start:start + n], counts,
+                                                       group_roles(rng, n))])
+
+    for start in range(0, num_repos, insert_chunk):
+        n = min(insert_chunk, num_repos - start)
+        counts = (rng.pareto(1.2, (n, 3)) * [50, 10, 5]).astype(int)
+        total = counts[:, 2] + rng.integers(0, 20, n)
+        con.executemany("insert into repo_ext values (?,?,?,?,?,?,?,?,?,?,?,?)",
+                        [[repo] + [int(x) for x in count] + [int(t)] + roles
+                         for repo, count, t, roles in zip(repos[start:start + n], counts, total,
+                                                          group_roles(rng, n))])
+
+    num_events = num_users * events_per_user
+    for start in range(0, num_events, insert_chunk):
+        n = min(insert_chunk, num_events - start)
+        actors = heavy_tailed_choice(rng, num_users, n)
+        event_repos = heavy_tailed_choice(rng, num_repos, n)
+        types = rng.integers(0, len(event_types), n)
+        con.executemany("insert into event values (?,?,?,?,?)",
+                        [(f"e{start + i}", event_types[t], users[a], repos[r], created_at)
+                         for i, (t, a, r, created_at) in enumerate(zip(types, actors, event_repos,
+                                                                       times(rng, n)))])
+
+    for start in range(0, num_prs, insert_chunk):
+        n = min(insert_chunk, num_prs - start)
+        authors = heavy_tailed_choice(rng, num_users, n)
+        pr_repos = heavy_tailed_choice(rng, num_repos, n)
+        closed = rng.random(n) < 0.7
+        merged = closed & (rng.random(n) < 0.6)
+        created = times(rng, n)
+        con.executemany("insert into pr_state values (?,?,?,?,?,?)",
+                        [(users[a], repos[r], "closed" if c else "open", int(m), t, t if m else None)
+                         for a, r, c, m, t in zip(authors, pr_repos, closed, merged, created)])
+
+    for start in range(0, num_issues, insert_chunk):
+        n = min(insert_chunk, num_issues - start)
+        authors = heavy_tailed_choice(rng, num_users, n)
+        closed = rng.random(n) < 0.5
+        comments = rng.poisson(2.0, n)
+        con.executemany("insert into issue_state values (?,?,?)",
+                        [(users[a], "closed" if c else "open", int(k))
+                         for a, c, k in zip(authors, closed, comments)])
+
+    con.commit()
+    con.close()
+
+    with open(path + ".users", "w") as f:
+        f.write("".join(user + "\n" for user in users))
+
+    print(f"wrote {path} ({num_users} users, {num_repos} repos, {num_events} events, "
+          f"{num_prs} pull requests, {num_issues} issues) and {path}.users in",
+          str(datetime.now() - timeA))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic event database.")
+    parser.add_argument("path")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--repos", type=int, default=20000)
+    parser.add_argument("--events-per-user", type=int, default=50)
+    parser.add_argument("--prs", type=int, default=50000)
+    parser.add_argument("--issues", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        parser.error(f"{args.path} already exists")
+
+    make_db(args.path, args.users, args.repos, args.events_per_user, args.prs, args.issues,
+            args.seed)
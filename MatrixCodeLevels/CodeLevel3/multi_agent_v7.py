@@ -7,43 +7,65 @@ Version 7:  Use exception handling to prevent crash of program when invalid or n
 from the database.
 """
 
-import json
 import socket
+import asyncio
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from random import randint
 from datetime import datetime
 from datetime import timedelta
-from math import log
-from uuid import uuid4
+import numpy as np
 from common import str_is_number
-from past_behavior_v5 import past_behavior_delta
-from past_behavior_v5 import past_behavior_alpha
-from get_repo_quality5 import get_fraction_merged_for_users_and_repos
-from get_repo_quality5 import get_fraction_of_issues_commented_for_users
+from common import event_types
+from agent_ids import read_agent_ids
+from feature_norm import normalize_deltas
+from feature_norm import normalize_alphas
+from event_index import build_event_index
+from user_features import load_user_features
+from repo_index import RepoIndex
+from past_behavior_v6 import past_behavior
+from past_behavior_v6 import past_behavior_batch
 from get_repo_quality5 import get_repo_quality
+from stats_cache import FractionStatsCache, RepoQualityCache
+from sqlite_connect import ConnectionFactory
+from lens_net import LensNet
+from lens_net import N_INPUTS
+from lens_net import N_OUTPUTS
+from rpc_transport import RPCException
+from rpc_transport import Transport
+from rpc_transport import negotiate_transport
+from stage_timers import StageTimers
+from stage_timers import no_timers
 
 import logbook
 
-from _c_code2 import ffi, lib  # Ron's new line
-
 _log = logbook.Logger(__name__)
 
 #event types in order:
-et = ["CreateEvent", "DeleteEvent", "ForkEvent", "IssuesEvent", "PullRequestEvent", "PushEvent", "WatchEvent", "IssueCommentEvent", "PullRequestReviewCommentEvent", "CommitCommentEvent"]
+et = event_types
 
-class RPCException(Exception):
-    pass
+# positions of an agent's features in its N_INPUTS neural net inputs
+user_inputs = slice(0, 10)     # user_ext features
+repo_inputs = slice(10, 21)    # repo_ext features
+delta_inputs = slice(21, 31)   # past behavior deltas, one per event type
+alpha_inputs = slice(31, 41)   # past behavior alphas, one per event type
+(user_acceptance_input, repo_acceptance_input,
+ repo_quality_input, user_commenting_input) = range(41, 45)
 
 
 class RPCProxy:  # pylint: disable=too-few-public-methods
     """
-    RPC Proxy class for calling controller functions.
+    RPC Proxy class for calling controller functions.  transport (a
+    rpc_transport.Transport) encodes and frames the messages; by default
+    they are compact JSON lines.
     """
 
-    def __init__(self, sock):
+    def __init__(self, sock, transport=None):
         self.sock = sock
-        self.fobj = sock.makefile(mode="r", encoding="ascii")
+        self.fobj = sock.makefile(mode="rb")
+        self.transport = transport if transport != None else Transport()
 
     def __del__(self):
         self.fobj.close()
@@ -55,18 +77,12 @@ class RPCProxy:  # pylint: disable=too-few-public-methods
 
         _log.info("Calling method: {}", method)
 
-        msg = {
-            "jsonrpc": "2.0",
-            "id": str(uuid4()),
-            "method": method,
-            "params": params
-        }
-        msg = json.dumps(msg) + "\n"  # NOTE: The newline is important
-        msg = msg.encode("ascii")
+        (msg_id, msg) = self.transport.request(method, params)
         self.sock.sendall(msg)
 
-        ret = self.fobj.readline()
-        ret = json.loads(ret)
+        ret = self.transport.read_response(self.fobj)
+        if ret == None:
+            raise RPCException("Connection closed by controller")
 
         if "jsonrpc" not in ret or ret["jsonrpc"] != "2.0":
             raise RPCException("Invalid RPC Response", ret)
@@ -76,12 +92,146 @@ class RPCProxy:  # pylint: disable=too-few-public-methods
         return ret["result"]
 
 
+class AsyncRPCProxy:
+    """
+    Pipelined RPC Proxy for calling controller functions.  Requests are sent
+    by an asyncio event loop in a background thread as soon as they are
+    submitted, without waiting for the responses to earlier ones, and each
+    response is matched to its request by id.  submit() returns a
+    concurrent.futures.Future for the result; call() waits for it, like
+    RPCProxy.call.  transport is as for RPCProxy.
+    """
+
+    def __init__(self, sock, transport=None):
+        self.transport = transport if transport != None else Transport()
+        self.pending = {}  # id -> asyncio future of each request sent and not answered
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+        asyncio.run_coroutine_threadsafe(self.connect(sock), self.loop).result()
+
+    async def connect(self, sock):
+        (self.reader, self.writer) = await asyncio.open_connection(sock=sock)
+        self.read_task = asyncio.ensure_future(self.read_responses())
+
+    async def read_responses(self):
+        while True:
+            ret = await self.transport.read_response_async(self.reader)
+            if ret == None:
+                error = RPCException("Connection closed by controller")
+                break
+
+            future = self.pending.pop(ret.get("id"), None)
+            if future == None or future.done():
+                continue
+
+            if "jsonrpc" not in ret or ret["jsonrpc"] != "2.0":
+                future.set_exception(RPCException("Invalid RPC Response", ret))
+            elif "error" in ret:
+                future.set_exception(RPCException("RPCException", ret))
+            else:
+                future.set_result(ret["result"])
+
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self.pending.clear()
+
+    async def async_call(self, method, **params):
+        """
+        Send the request and wait for its response.
+        """
+
+        _log.info("Calling method: {}", method)
+
+        (msg_id, msg) = self.transport.request(method, params)
+        future = self.loop.create_future()
+        self.pending[msg_id] = future
+
+        self.writer.write(msg)
+        await self.writer.drain()
+
+        return await future
+
+    def submit(self, method, **params):
+        """
+        Send the request now and return a future for its result.
+        """
 
+        return asyncio.run_coroutine_threadsafe(self.async_call(method, **params), self.loop)
 
+    def call(self, method, **params):
+        """
+        Call the remote function.
+        """
 
+        return self.submit(method, **params).result()
 
+    async def disconnect(self):
+        self.read_task.cancel()
+        try:
+            await self.read_task
+        except asyncio.CancelledError:
+            pass
+        self.writer.close()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.disconnect(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+
+
+
+
+# scorer selects how the agents' neural net inputs are scored:
+#   "lens":  by Lens through c_code2
+#   "numpy": by a NumPy forward pass with the weights of orr.2000.wt
+# online_learning (Lens only) also trains the net on each agent's inputs as
+# it is scored, so the weights change during the round.  By default only
+# the forward pass is run, which is cheaper and gives the same outputs for
+# the same inputs in every round.
+# preload_repo_features keeps the normalized features of every valid repo in
+# memory (memory-mapped), instead of reading each chosen repo's row.
+# debug prints each agent's features and neural net inputs as strings.
+# num_workers > 1 computes the agents' inputs in a pool of that many threads,
+# each with its own database connection, in one process with one Lens net
+# and one controller connection.  With the numpy scorer each thread also
+# scores its agents; Lens is not reentrant, so it scores the whole round in
+# one call from the main thread.
+# scheduler (an AgentScheduler shared by all agent processes) hands out the
+# agents of each round in chunks instead of evaluating all agent ids every
+# round; every process then reads the same agent ids (num_agents_per_proc is
+# the total number of agents) and worker is this process's number.
+# pipelined sends each round's register_events and the next
+# can_we_start_yet together without waiting for the responses, and chooses
+# the next round's repos while the controller starts the round.
+# event_chunk_size evaluates the agents of a round event_chunk_size at a
+# time and sends the events to the controller with register_events_chunk
+# every event_chunk_size events, as soon as the batch completing them is
+# scored, and the rest with the round's register_events call, instead of
+# all at once at the end of the round (the controller must support
+# register_events_chunk).  Sending
+# overlaps evaluating the next batch only if pipelined is set; otherwise
+# each register_events_chunk call waits for the controller's answer.
+# negotiate asks the controller for a more compact message encoding and
+# framing than JSON lines (see rpc_transport), keeping JSON lines if it does
+# not support any.
+# stage_timing times each stage of evaluating the agents (see stage_timers)
+# and logs each round's times, or appends them to metrics_file as JSON lines
+# if it is given.
 def main_multi_agent(address, event_db, agent_ids_file, agent_id_start_idx,
-                     num_agents_per_proc, num_repos):
+                     num_agents_per_proc, scorer="lens",
+                     online_learning=False, preload_repo_features=False,
+                     debug=False, num_workers=1, scheduler=None, worker=0,
+                     pipelined=False, event_chunk_size=None, negotiate=False,
+                     stage_timing=False, metrics_file=None, db_options=None):
+
+    if online_learning and scorer != "lens":
+        raise ValueError(f"online learning is not supported by the {scorer} scorer")
 
     starting_time = datetime.now()
 
@@ -93,13 +243,8 @@ def main_multi_agent(address, event_db, agent_ids_file, agent_id_start_idx,
 
     # Read agent login_h values from the given file starting at
     # the agent_id_start_idx and for num_agents_per_proc many agents
-    agent_ids = []
-    with open(agent_ids_file, 'r') as agent_ids_file:
-        count = 0
-        for idx, line in enumerate(agent_ids_file):
-            if idx >= agent_id_start_idx and count < num_agents_per_proc:
-                agent_ids.append(line.rstrip("\r\n"))
-                count += 1
+    # (seeking to the first with the file's line offset index)
+    agent_ids = read_agent_ids(agent_ids_file, agent_id_start_idx, num_agents_per_proc)
 
     logbook.StderrHandler().push_application()
 
@@ -113,326 +258,472 @@ def main_multi_agent(address, event_db, agent_ids_file, agent_id_start_idx,
 
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
         sock.connect(address)
-        proxy = RPCProxy(sock)
 
-        _log.notice("Opening event database: {}", event_db)
-        con = sqlite3.connect(event_db)
+        if negotiate:
+            transport = negotiate_transport(RPCProxy(sock).call)
+            _log.notice("Transport: {} {}", transport.codec.name, transport.framing.name)
+        else:
+            transport = None
 
-        lib.initCommonNeuralNet()  # Ron's new line
+        if pipelined:
+            proxy = AsyncRPCProxy(sock, transport)
+        else:
+            proxy = RPCProxy(sock, transport)
+
+        # connections to the event database (or a staged copy of it), opened
+        # with db_options (see sqlite_connect.ConnectionFactory)
+        _log.notice("Opening event database: {} {}", event_db, db_options or {})
+        connections = ConnectionFactory(event_db, **(db_options or {}))
+        con = connections.connect()
+
+        # per-type event times of this process's agents, kept up to date
+        # with the events they register, for the past behavior counts.  With
+        # a scheduler the agents of a chunk may have been evaluated by
+        # another process in the previous round, so their past behavior is
+        # counted from the event table (with a query for the whole chunk)
+        # instead.
+        if scheduler == None:
+            event_index = build_event_index(con, agent_ids)
+        else:
+            event_index = None
+
+        # normalized user_ext features of the agents, which do not change
+        user_features = load_user_features(con, agent_ids)
+
+        # rowids of the repo_ext rows with valid features to choose repos from
+        # (with their normalized features if preload_repo_features is set)
+        repo_index = RepoIndex.load_or_build(con, event_db, preload_repo_features)
+
+        # fraction merged and fraction commented tables, computed once and
+        # then updated for the rows touched by each round's events
+        stats = FractionStatsCache(event_db)
+        stats.load_or_build(con)
+
+        # repo quality of every repo with pull requests, recomputed only for
+        # the repos whose users' fraction merged changed
+        repo_quality = RepoQualityCache(stats)
+        repo_quality.build(con)
+
+        if stage_timing:
+            timers = StageTimers(metrics_file, worker)
+        else:
+            timers = no_timers
+
+        # futures of the register calls not yet checked (pipelined)
+        registered = []
+
+        # register sends events to the controller with method (a full chunk
+        # with register_events_chunk, or the rest of the round with
+        # register_events) and adds them to the event index and the users
+        # and repos for the next stats update
+        def register(method, events):
+            if pipelined:
+                registered.append(proxy.submit(method, events=events))
+            else:
+                proxy.call(method, events=events)
+            if event_index != None:
+                event_index.add_events(events)
+            stats.note_events(events)
+
+        if scorer == "numpy":
+            net = LensNet()
+        else:
+            net = None
+            from _c_code2 import lib  # only the Lens scorer needs the extension
+            lib.initCommonNeuralNet()  # Ron's new line
+
+        if num_workers > 1:
+            pool = ThreadPoolExecutor(num_workers)
+        else:
+            pool = None
+
+        if pipelined:
+            presampler = ThreadPoolExecutor(1)
+            next_round_info = proxy.submit("can_we_start_yet")
+            next_repos = None
 
         print('\ninitialization time:', str(datetime.now() - starting_time))
 
         while True:
-            round_info = proxy.call("can_we_start_yet")
+            if pipelined:
+                round_info = next_round_info.result()
+                for future in registered:
+                    future.result()  # raises if register_events failed
+                registered.clear()
+            else:
+                round_info = proxy.call("can_we_start_yet")
             _log.info("Round {}", round_info)
 
             # if round is -1 we end the simulation
             if round_info['cur_round'] == -1:
+                if pool != None:
+                    pool.shutdown()
+                if pipelined:
+                    presampler.shutdown()
+                    proxy.close()
+                connections.close()
                 print('\ncompletion time:', str(datetime.now() - starting_time))
                 return
 
+            # repos chosen for this round's agents while it was starting
+            repos = None
+            if pipelined and next_repos != None:
+                try:
+                    repos = iter(next_repos.result())
+                except:
+                    repos = None  # choose each agent's repo as it is evaluated
+
+            stats.update(con)  # with the events registered in the previous round
+            repo_quality.invalidate()
+
             tt = randint(round_info['start_time'], round_info['end_time'] - 1)
             dt = datetime.utcfromtimestamp(tt)
             dt_str = dt.isoformat() + 'Z'
             events = []
-            (fraction_merged_for_users, fraction_merged_for_repos) = get_fraction_merged_for_users_and_repos(con)
-
-            fraction_commented_for_users = get_fraction_of_issues_commented_for_users(con)
-
-            for agent_id in agent_ids:
-                print('\n\n********************************************************\n\n')
-                print("date/time= ", dt_str)
-                print('\n\n********************************************************\n\n')
-
-                try:
-                    ret = do_something_per_agent(con, agent_id, num_repos,
-                                             round_info['cur_round'], dt_str,
-                                             fraction_merged_for_users,
-                                             fraction_merged_for_repos,
-                                             fraction_commented_for_users)
-                    if ret != None:
-                        events.extend(ret)
-                except:
-                    continue  # if an error occurred in do_something_per_agent and was
-                              # not caught in that function, skip this agent and
-                              # continue with next agent to prevent crash.
+            fraction_merged_for_users = stats.fraction_merged_for_users
+            fraction_merged_for_repos = stats.fraction_merged_for_repos
+            fraction_commented_for_users = stats.fraction_commented_for_users
+
+            round_args = dict(repo_index=repo_index, round_num=round_info['cur_round'],
+                              dt_str=dt_str,
+                              fraction_merged_for_users=fraction_merged_for_users,
+                              fraction_merged_for_repos=fraction_merged_for_repos,
+                              fraction_commented_for_users=fraction_commented_for_users,
+                              event_index=event_index, repo_quality=repo_quality,
+                              repos=repos, timers=timers, debug=debug)
+
+            if scheduler == None:
+                agent_chunks = [range(len(agent_ids))]
+            else:
+                scheduler.start_round(round_info['cur_round'])
+                agent_chunks = scheduler.chunks(round_info['cur_round'])
+
+            if event_chunk_size != None:
+                # evaluated in batches of event_chunk_size agents, so that
+                # their events are sent while the next batch is evaluated
+                agent_chunks = batches(agent_chunks, event_chunk_size)
+
+            timeA = datetime.now()
+            round_agent_ids = []
+            num_events = 0
+
+            for chunk in agent_chunks:
+                chunk_agent_ids = agent_ids[chunk.start:chunk.stop]
+                chunk_user_features = user_features[chunk.start:chunk.stop]
+                round_agent_ids.extend(chunk_agent_ids)
+
+                if pool == None:
+                    (scored_agents, inputs) = agents_inputs(con, chunk_agent_ids,
+                                                            chunk_user_features, **round_args)
+
+                    # evaluate the chunk's agents in one call on the neural net
+                    with timers.stage("neural net"):
+                        (outputs, argmax) = run_common_neural_net_batch(inputs, net, online_learning)
+                else:
+                    (scored_agents, outputs, argmax) = evaluate_agents_in_pool(
+                        pool, num_workers, connections, chunk_agent_ids, chunk_user_features,
+                        net, online_learning, **round_args)
+
+                for (agent_id, repo_id), agent_outputs, imax in zip(scored_agents, outputs, argmax):
+                    with timers.stage("event build"):
+                        events.extend(agent_events(agent_id, repo_id, round_info['cur_round'],
+                                                   dt_str, agent_outputs, imax))
+
+                    if event_chunk_size != None and len(events) >= event_chunk_size:
+                        num_events += len(events)
+                        with timers.stage("register events"):
+                            register("register_events_chunk", events)
+                        events = []
+
+            num_events += len(events)
+
+            seconds = (datetime.now() - timeA).total_seconds()
+            print('\nworker', worker, 'round', round_info['cur_round'], 'evaluated',
+                  len(round_agent_ids), 'agents in', seconds, 'seconds')
+
+            with timers.stage("register events"):
+                register("register_events", events)
+            timers.emit(round_info['cur_round'])
+
+            if pipelined:
+                # the controller answers can_we_start_yet once all agent
+                # processes have registered their events; meanwhile choose
+                # a repo for each agent evaluated this round
+                next_round_info = proxy.submit("can_we_start_yet")
+                next_repos = presampler.submit(sample_repos, connections, repo_index, num_events)
+
+            if scheduler != None:
+                scheduler.record(worker, len(round_agent_ids), seconds)
+
+
+# batches splits each range of agent indices of chunks into ranges of at most
+# size agents.  Each chunk is taken from chunks only once the batches of the
+# previous one are evaluated, so that a scheduler's chunks are claimed as
+# the process gets to them and the others can take the rest of the round.
+def batches(chunks, size):
+    for chunk in chunks:
+        for start in range(chunk.start, chunk.stop, size):
+            yield range(start, min(start + size, chunk.stop))
+
+
+# agents_inputs computes the neural net inputs of each of agent_ids (with
+# user_features their user_feature_dtype records) with agent_inputs, with the
+# past behavior of all of them counted at once by past_behavior_batch.
+# Returns ((agent_id, repo_id) for each agent with valid features, their
+# inputs as an N x N_INPUTS float32 array).  round_args are the other
+# arguments of agent_inputs.
+def agents_inputs(con, agent_ids, user_features, **round_args):
+    scored_agents = []  # (agent_id, repo_id) for each row of inputs
+
+    # one row of neural net inputs for each agent, filled in place
+    inputs = np.zeros((len(agent_ids), N_INPUTS), dtype=np.float32)
+
+    # normalized past behavior deltas and alphas of each agent
+    with round_args.get("timers", no_timers).stage("past_behavior batch"):
+        try:
+            behavior = past_behavior_batch(round_args["dt_str"], agent_ids, con,
+                                           round_args.get("event_index"),
+                                           delta_period=14, alpha_period=60)
+            behavior_inputs = zip(normalize_deltas(behavior[:, :len(et)]),
+                                  normalize_alphas(behavior[:, len(et):]))
+        except:
+            behavior_inputs = [None] * len(agent_ids)  # counted for each agent
 
-            proxy.call("register_events", events=events)
+    for agent_id, agent_user_features, agent_behavior_inputs in zip(agent_ids, user_features,
+                                                                    behavior_inputs):
+        print('\n\n********************************************************\n\n')
+        print("date/time= ", round_args["dt_str"])
+        print('\n\n********************************************************\n\n')
 
-def normalize_count(data, dmin, dmax):
-    if data == 0:
-        data = 1
-    data = log(data)
+        try:
+            repo_id = agent_inputs(con, agent_id, agent_user_features,
+                                   inputs=inputs[len(scored_agents)],
+                                   past_behavior_inputs=agent_behavior_inputs, **round_args)
+            if repo_id != None:
+                scored_agents.append((agent_id, repo_id))
+        except:
+            continue  # if an error occurred in agent_inputs and was
+                      # not caught in that function, skip this agent and
+                      # continue with next agent to prevent crash.
 
-    if dmin == 0:
-        dmin = 1
-    dmin = log(dmin) 
+    return (scored_agents, inputs[:len(scored_agents)])
 
-    if dmax == 0:
-        dmax = 1
-    dmax = log(dmax) 
 
-    if data < dmin:
-        data = dmin
+# each pool thread opens its own connection to the event database, since a
+# sqlite3 connection can only be used by the thread that opened it
+worker_local = threading.local()
 
-    if data > dmax:
-        data = dmax
 
-    return (data - dmin) / (dmax - dmin)
+def worker_connection(connections):
+    if getattr(worker_local, "con", None) == None:
+        worker_local.con = connections.connect()
+    return worker_local.con
 
-def normalize_delta(data, dmin, dmax):
-    data = log(data + 2.0)
-    dmin = log(dmin + 2.0) 
-    dmax = log(dmax + 2.0) 
 
-    if data < dmin:
-        data = dmin
+# sample_repos chooses n repos at random from repo_index (as agent_inputs
+# does), with the calling thread's own connection from connections (a
+# ConnectionFactory).
+def sample_repos(connections, repo_index, n):
+    con = worker_connection(connections)
+    return [repo_index.sample(con) for i in range(n)]
 
-    if data > dmax:
-        data = dmax
 
-    return (data - dmin) / (dmax - dmin)
+# evaluate_agents_in_pool splits agent_ids into num_workers chunks, computes
+# each chunk's inputs in its own pool thread and scores them there with net
+# (a LensNet, which is reentrant, and NumPy releases the GIL in the matrix
+# multiplies), or, without net, scores the whole round with Lens in the
+# calling thread.  Returns (scored_agents, outputs, argmax) in the order of
+# agent_ids, like agents_inputs and run_common_neural_net_batch.
+def evaluate_agents_in_pool(pool, num_workers, connections, agent_ids, user_features,
+                            net, learn, **round_args):
 
+    timers = round_args.get("timers", no_timers)
 
+    def evaluate_chunk(chunk):
+        con = worker_connection(connections)
+        (scored_agents, inputs) = agents_inputs(con, [agent_ids[i] for i in chunk],
+                                                user_features[chunk], **round_args)
+        if net != None:
+            with timers.stage("neural net"):
+                return (scored_agents, inputs) + net.run(inputs)
+        return (scored_agents, inputs, None, None)
 
-def do_something_per_agent(con: sqlite3.Connection, agent_id, num_repos,
-                           round_num, dt_str,
-                           fraction_merged_for_users,
-                           fraction_merged_for_repos,
-                           fraction_commented_for_users):
+    chunks = np.array_split(np.arange(len(agent_ids)), num_workers)
+    results = list(pool.map(evaluate_chunk, chunks))
 
-    print('\n\nRound #:', round_num, 'agent_id:', agent_id, '\n')
+    scored_agents = [agent for result in results for agent in result[0]]
 
-    cur = con.cursor()
-    sql = """
-          select public_repos, followers, following,
-          PendNbrs, pendant, inG2deg, inG1deg, pTiesIngG1, ptiesingg2, isHub
-          from user_ext
-          where login_h = ?
-          """
-    cur.execute(sql, (agent_id,))
-    print(agent_id)
+    if net != None:
+        outputs = np.concatenate([result[2] for result in results])
+        argmax = np.concatenate([result[3] for result in results])
+    else:
+        inputs = np.concatenate([result[1] for result in results])
+        with timers.stage("neural net"):
+            (outputs, argmax) = run_common_neural_net_batch(inputs, None, learn)
 
-    row = cur.fetchone()
+    return (scored_agents, outputs, argmax)
 
-#   if row == None:
-#       return None
-#   The above code was put in to prevent crashing on a null row.  It is now
-#   caught by the exception below when None is assigned to a tuple of variables.
 
-    try:
-        (public_repos, followers, following,
-        PendNbrs, pendant, inG2deg, inG1deg, pTiesIngG1, ptiesingg2, isHub
-        ) = row
+# inputs_to_string returns an agent's neural net inputs as a string of
+# numbers separated by spaces (the format of runCommonNeuralNet), for
+# debugging.
+def inputs_to_string(inputs):
+    return " ".join(str(x) for x in inputs)
 
-        public_repos = str(normalize_count(public_repos, 0.0, 132125.0))
-        followers = str(normalize_count(followers, 0.0, 20238.0))
-        following = str(normalize_count(following, 0.0, 24604.0))
 
-        if PendNbrs == None:  # user not in group_roles table
-            PendNbrs = '0'
-        else:
-            PendNbrs = str(normalize_count(float(PendNbrs), 0.0, 169481.0))
+# run_common_neural_net_batch evaluates the common neural net on each row of
+# inputs (N rows of N_INPUTS numbers) with a single call into c_code2, or
+# with net (a LensNet) if given.  If learn is set, Lens also trains the net
+# on each row.  Returns an N x N_OUTPUTS float32 array of outputs and the
+# N indices of the largest output in each row.
+def run_common_neural_net_batch(inputs, net=None, learn=False):
+    inputs = np.ascontiguousarray(inputs, dtype=np.float32).reshape(-1, N_INPUTS)
+    n = inputs.shape[0]
 
-        if pendant == None:   # user not in group_roles table
-            pendant = '0'
-        else:  # if pendant is not a number, an exception is
-               # triggerred causing None to be returned.
-            float(pendant)
+    if net is not None:
+        return net.run(inputs)
 
-        if inG2deg == None:   # user not in group_roles table
-            inG2deg = '0'
-        else:
-            inG2deg = str(normalize_count(float(inG2deg), 0.0, 169569.0))
+    from _c_code2 import ffi, lib
 
+    outputs = np.zeros((n, N_OUTPUTS), dtype=np.float32)
+    argmax = np.zeros(n, dtype=np.intc)
 
-        if inG1deg == None:   # user not in group_roles table
-            inG1deg = '0'
-        else:
-            inG1deg = str(normalize_count(float(inG1deg), 0.0, 169569.0))
+    if learn:
+        run_batch = lib.runCommonNeuralNetBatch
+    else:
+        run_batch = lib.runCommonNeuralNetForwardBatch
 
+    if n > 0:
+        run_batch(ffi.from_buffer("float[]", inputs), n,
+                  ffi.from_buffer("float[]", outputs, require_writable=True),
+                  ffi.from_buffer("int[]", argmax, require_writable=True))
 
-        if pTiesIngG1 == None:        # user not in group_roles table
-            pTiesIngG1 = '0'
-        else:  # if pTiesIngG1 is not a number, an exception is
-               # triggerred causing None to be returned.
-            float(pTiesIngG1)
+    return (outputs, argmax)
 
-        if ptiesingg2 == None:        # user not in group_roles table
-            ptiesingg2 = '0'
-        else:
-            float(ptiesingg2)
 
-        if isHub == None:     # user not in group_roles table
-            isHub = '0'
-        else:
-            float(isHub)
+def do_something_per_agent(con: sqlite3.Connection, agent_id, repo_index,
+                           round_num, dt_str,
+                           fraction_merged_for_users,
+                           fraction_merged_for_repos,
+                           fraction_commented_for_users,
+                           event_index=None, online_learning=False):
 
-    except:
+    user_features = load_user_features(con, [agent_id])[0]
+    inputs = np.zeros(N_INPUTS, dtype=np.float32)
+    repo_id = agent_inputs(con, agent_id, user_features, repo_index, round_num, dt_str,
+                           fraction_merged_for_users,
+                           fraction_merged_for_repos,
+                           fraction_commented_for_users,
+                           inputs, event_index)
+    if repo_id == None:
         return None
 
+    (outputs, argmax) = run_common_neural_net_batch(inputs, None, online_learning)
+
+    return agent_events(agent_id, repo_id, round_num, dt_str, outputs[0], argmax[0])
+
+
+# agent_inputs looks up the features of a randomly chosen repo and the past
+# behavior of agent_id, writes the agent's neural net inputs into inputs (a
+# float32 array of N_INPUTS) and returns the repo_id, or None if the agent's
+# features are not valid.  user_features is the agent's user_feature_dtype
+# record and repo_index the RepoIndex the repo is chosen from.  The repo's
+# quality is taken from repo_quality (a RepoQualityCache) if given.  repos is
+# an iterator of repos chosen in advance with repo_index.sample, shared by
+# the agents of a round; the repo is chosen when it is used up.  The past
+# behavior is counted for the agent unless past_behavior_inputs gives its
+# normalized (deltas, alphas), as computed by agents_inputs.  timers (a
+# StageTimers) times each stage.  debug prints the features and inputs as
+# strings.
+def agent_inputs(con: sqlite3.Connection, agent_id, user_features, repo_index,
+                 round_num, dt_str,
+                 fraction_merged_for_users,
+                 fraction_merged_for_repos,
+                 fraction_commented_for_users,
+                 inputs, event_index=None, repo_quality=None, repos=None,
+                 past_behavior_inputs=None, timers=no_timers, debug=False):
 
+    print('\n\nRound #:', round_num, 'agent_id:', agent_id, '\n')
 
-    afeatures = (public_repos + " " + followers + " " + following + " " +
-                PendNbrs + " " + pendant + " " + inG2deg + " " + inG1deg + " " +
-                pTiesIngG1 + " " + ptiesingg2 + " " + isHub)
-
-    print("public_repos(", agent_id, ") = ", public_repos)
-    print("followers(", agent_id, ") = ", followers)
-    print("following(", agent_id, ") = ", following)
-    print("afeatures(", agent_id, ") = ", afeatures)
-
-    while True:
-        # choose a row_id at random, look up its features in database
-        row_id = randint(1, num_repos)
-        print("row_id = ", row_id)
-
-              	# full_name_h is the repo_id
-        sql = """
-              select full_name_h, watchers_count, forks_count, "issue.open_count", "issue.total_count",
-              PendNbrs, pendant, inG2deg, inG1deg, pTiesIngG1, ptiesingg2, isHub
-              from repo_ext
-              where rowid = ?
-              """
-        cur.execute(sql, (row_id,))
-
-        row = cur.fetchone() # if this returns None, choose another row_id and repeat
-
-        try:
-            (repo_id, watchers_count, forks_count, issue_open_count, issue_total_count,
-             PendNbrs, pendant, inG2deg, inG1deg, pTiesIngG1, ptiesingg2, isHub) = row
-
-            if issue_total_count == None:  # database contains some null values for issue_total_count
-                issue_total_count = issue_open_count
-
-            watchers_count = str(normalize_count(watchers_count, 0.0, 291574.0))
-            forks_count = str(normalize_count(forks_count, 0.0, 107293.0))
-            issue_open_count = str(normalize_count(issue_open_count, 0.0, 51903.0))
-            issue_total_count = str(normalize_count(issue_total_count, 0.0, 51903.0))
-
-            if PendNbrs == None:  # repo not in group_roles table
-                PendNbrs = '0'
-            else:
-                PendNbrs = str(normalize_count(float(PendNbrs), 0.0, 2776.0))
-
-
-            if pendant == None:   # repo not in group_roles table
-                pendant = '0'
-            else: # if pendant is not a number, an exception is
-                  # triggerred causing a new row to be chosen and repeat
-                float(pendant)
-
-            if inG2deg == None:   # repo not in group_roles table
-                inG2deg = '0'
-            else:
-                inG2deg = str(normalize_count(float(inG2deg), 0.0, 40876.0))
-
-
-            if inG1deg == None:   # repo not in group_roles table
-                inG1deg = '0'
-            else:
-                inG1deg = str(normalize_count(float(inG1deg), 0.0, 97415.0))
-
-
-            if pTiesIngG1 == None:        # repo not in group_roles table
-                pTiesIngG1 = '0'
-            else: # if pTiesIngG1 is not a number, an exception is
-                  # triggerred causing a new row to be chosen and repeat
-                float(pTiesIngG1)
-
-
-            if ptiesingg2 == None:        # repo not in group_roles table
-                ptiesingg2 = '0'
-            else: # if ptiesingg2 is not a number, an exception is
-                  # triggerred causing a new row to be chosen and repeat
-                float(ptiesingg2)
-
-
-            if isHub == None:     # repo not in group_roles table
-                isHub = '0'
-            else:
-                float(isHub)
- 
-            break  # good values, don't repeat random choice of row
-
-        except:
-            continue
-
+    with timers.stage("user lookup"):
+        if not user_features["valid"]:
+            return None
 
+        inputs[user_inputs] = user_features["features"]
 
-    rfeatures = (watchers_count + " " + forks_count + " " + issue_open_count + " " + issue_total_count + " " +
-                 PendNbrs + " " + pendant + " " + inG2deg + " " + inG1deg + " " +
-                 pTiesIngG1 + " " + ptiesingg2 + " " + isHub)
+    print(agent_id)
 
-    print("repo_id(", row_id, ") = ", repo_id)
-    print("watchers_count(", row_id, ") = ", watchers_count)
-    print("forks_count(", row_id, ") = ", forks_count)
-    print("issue.open_count(", row_id, ") = ", issue_open_count)
-    print("issue.total_count(", row_id, ") = ", issue_total_count)
-    print("rfeatures =", rfeatures)
+    if debug:
+        print("public_repos(", agent_id, ") = ", inputs[0])
+        print("followers(", agent_id, ") = ", inputs[1])
+        print("following(", agent_id, ") = ", inputs[2])
+        print("afeatures(", agent_id, ") = ", inputs_to_string(inputs[user_inputs]))
+
+    # choose a repo with valid features at random
+    with timers.stage("repo sampling"):
+        repo = next(repos, None) if repos != None else None
+        if repo == None:
+            repo = repo_index.sample(con)
+        (row_id, repo_id, repo_features) = repo
+        inputs[repo_inputs] = repo_features
+    print("row_id = ", row_id)
+
+    if debug:
+        print("repo_id(", row_id, ") = ", repo_id)
+        print("watchers_count(", row_id, ") = ", inputs[10])
+        print("forks_count(", row_id, ") = ", inputs[11])
+        print("issue.open_count(", row_id, ") = ", inputs[12])
+        print("issue.total_count(", row_id, ") = ", inputs[13])
+        print("rfeatures =", inputs_to_string(inputs[repo_inputs]))
 
                             # past behavior metrics for each type of event
-    past_behavior = past_behavior_delta(dt_str, 14, agent_id, con)
-    pb0 = str(normalize_delta(past_behavior[et[0]], -1.0, 32964.0))
-    pb1 = str(normalize_delta(past_behavior[et[1]], -1.0, 2544.17))
-    pb2 = str(normalize_delta(past_behavior[et[2]], -1.0, 1781.0))
-    pb3 = str(normalize_delta(past_behavior[et[3]], -1.0, 8189.0))
-    pb4 = str(normalize_delta(past_behavior[et[4]], -1.0, 3528.0))
-    pb5 = str(normalize_delta(past_behavior[et[5]], -1.0, 12235.67))
-    pb6 = str(normalize_delta(past_behavior[et[6]], -1.0, 2074.4))
-    pb7 = str(normalize_delta(past_behavior[et[7]], -1.0, 615.5))
-    pb8 = str(normalize_delta(past_behavior[et[8]], -1.0, 141.0))
-    pb9 = str(normalize_delta(past_behavior[et[9]], -1.0, 136.35))
-
-    past_behavior_deltas = pb0 + " " + pb1 + " " + pb2 + " " + pb3 + " " + pb4 + " " + pb5 + " " + pb6 + " " + pb7 + " " + pb8 + " " + pb9
-
-
-    past_behavior = past_behavior_alpha(dt_str, 60, agent_id, con)
-    pb0 = str(normalize_count(past_behavior[et[0]],  0.0, 143008.0))
-    pb1 = str(normalize_count(past_behavior[et[1]],  0.0, 75741.0))
-    pb2 = str(normalize_count(past_behavior[et[2]],  0.0, 22283.0))
-    pb3 = str(normalize_count(past_behavior[et[3]],  0.0, 28526.0))
-    pb4 = str(normalize_count(past_behavior[et[4]],  0.0, 43254.0))
-    pb5 = str(normalize_count(past_behavior[et[5]],  0.0, 2034093.0))
-    pb6 = str(normalize_count(past_behavior[et[6]],  0.0, 32962.0))
-    pb7 = str(normalize_count(past_behavior[et[7]],  0.0, 92571.0))
-    pb8 = str(normalize_count(past_behavior[et[8]],  0.0, 62128.0))
-    pb9 = str(normalize_count(past_behavior[et[9]],  0.0, 4303.0))
-
-    past_behavior_alphas = pb0 + " " + pb1 + " " + pb2 + " " + pb3 + " " + pb4 + " " + pb5 + " " + pb6 + " " + pb7 + " " + pb8 + " " + pb9
-
-
-
-    if agent_id in fraction_merged_for_users:
-        user_acceptance = str(round(fraction_merged_for_users[agent_id],2))
+    if past_behavior_inputs != None:
+        (inputs[delta_inputs], inputs[alpha_inputs]) = past_behavior_inputs
     else:
-        user_acceptance = "0" # this user has not made any closed pull requests
+        with timers.stage("past_behavior"):
+            (deltas, alphas) = past_behavior(dt_str, agent_id, con, event_index,
+                                             delta_period=14, alpha_period=60)
+            inputs[delta_inputs] = normalize_deltas([deltas[etype] for etype in et])
+            inputs[alpha_inputs] = normalize_alphas([alphas[etype] for etype in et])
+
+    with timers.stage("repo quality"):
+        if agent_id in fraction_merged_for_users:
+            inputs[user_acceptance_input] = round(fraction_merged_for_users[agent_id],2)
+        else:
+            inputs[user_acceptance_input] = 0 # this user has not made any closed pull requests
 
-    if repo_id in fraction_merged_for_repos:
-        repo_acceptance = str(round(fraction_merged_for_repos[repo_id],2))
-    else:
-        repo_acceptance = "0" # this repo does not have any closed pull requests
+        if repo_id in fraction_merged_for_repos:
+            inputs[repo_acceptance_input] = round(fraction_merged_for_repos[repo_id],2)
+        else:
+            inputs[repo_acceptance_input] = 0 # this repo does not have any closed pull requests
+
+        if repo_quality != None:
+            repo_qual = repo_quality.get(con, repo_id)
+        else:
+            repo_qual = get_repo_quality(con, repo_id, fraction_merged_for_users)
+        inputs[repo_quality_input] = round(repo_qual,2)  # should 0 be used instead of None
 
-    repo_qual = get_repo_quality(con, repo_id, fraction_merged_for_users)
-    rq_feature = str(round(repo_qual,2))  # should 0 be used instead of None
+        if agent_id in fraction_commented_for_users:
+            inputs[user_commenting_input] = round(fraction_commented_for_users[agent_id],2)
+        else:
+            inputs[user_commenting_input] = 0 # this user has not made any issues
 
-    if agent_id in fraction_commented_for_users:
-        user_commenting = str(round(fraction_commented_for_users[agent_id],2))
-    else:
-        user_commenting = "0" # this user has not made any issues
+    if debug:
+        inputs_str = inputs_to_string(inputs)
+        print(agent_id, 'I:', inputs_str)
+        print("spaces:", inputs_str.count(" "))
+        print(inputs_str.replace(" ", "  //  "))
 
+    return repo_id
 
-    inputs = afeatures + " " + rfeatures + " " + past_behavior_deltas + " " + past_behavior_alphas + " " + user_acceptance + " " + repo_acceptance + " " + rq_feature + " " + user_commenting
 
-    print(agent_id, 'I:', inputs)
-    print("spaces:", inputs.count(" "))
+# agent_events returns the set of events that agent_id does in this round,
+# given the neural net outputs for the agent and the index of the largest.
+def agent_events(agent_id, repo_id, round_num, dt_str, outputs, imax):
 
-    pOuts = lib.runCommonNeuralNet(inputs.encode())
-    # Return the set of events that need to be done in this round.
-    outs = ffi.string(pOuts).decode()
+    outs = et[imax] + ":" + "".join("%.3f " % output for output in outputs)
     outlist = outs.split(':')
 
-    print(inputs.replace(" ", "  //  "))
     print(f"runCommonNeuralNet (login_h: {agent_id}) returns: " + outs)
 
     events = [{
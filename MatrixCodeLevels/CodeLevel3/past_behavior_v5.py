@@ -16,7 +16,9 @@ from uuid import uuid4
 
 # count_events returns dictionary of number of events of each type
 # that occur between dt1 and dt2 for user_id.
-def count_events(dt1, dt2, user_id, con):
+# If index (an EventCountIndex) contains user_id, the counts are looked
+# up in the index instead of queried from the event table.
+def count_events(dt1, dt2, user_id, con, index=None):
 
     cur = con.cursor()
 
@@ -39,34 +41,37 @@ def count_events(dt1, dt2, user_id, con):
 
     timeA = datetime.now()
 
-    if user_id == "":
-        sql = """
-            select type
-            from event
-            where (created_at >= ?)
-            and   (created_at <  ?)
-            """
-        cur.execute(sql, (dtstr1, dtstr2))
+    if index is not None and user_id in index:
+        event_count.update(index.count(dtstr1, dtstr2, user_id))
     else:
-        sql = """
-            select type
-            from event
-            where "actor.login_h" = ?
-            and (created_at >= ?)
-            and (created_at <  ?)
-            """
-        cur.execute(sql, (user_id, dtstr1, dtstr2))
+        if user_id == "":
+            sql = """
+                select type
+                from event
+                where (created_at >= ?)
+                and   (created_at <  ?)
+                """
+            cur.execute(sql, (dtstr1, dtstr2))
+        else:
+            sql = """
+                select type
+                from event
+                where "actor.login_h" = ?
+                and (created_at >= ?)
+                and (created_at <  ?)
+                """
+            cur.execute(sql, (user_id, dtstr1, dtstr2))
 
-    while True:
-        row = cur.fetchone()
-        if row == None:
-            break
+        while True:
+            row = cur.fetchone()
+            if row == None:
+                break
 
-        (etype,) = row
+            (etype,) = row
 
 
-        if etype in event_count:
-            event_count[etype] += 1
+            if etype in event_count:
+                event_count[etype] += 1
 
     timeB = datetime.now()
     print('\ntime in count_events query=', str(timeB-timeA))
@@ -77,18 +82,18 @@ def count_events(dt1, dt2, user_id, con):
     return event_count
 
 
-def past_behavior_delta(current_timestr, period_length, user_id, con):
+def past_behavior_delta(current_timestr, period_length, user_id, con, index=None):
     print('running version 5 of past_behavior')
     dt_current_time = datetime.strptime(current_timestr, format)
     delta = timedelta(days=period_length)
 
     print("\nFor user ", user_id)
     print("\nevent count for last period:")
-    last_period = count_events(dt_current_time-delta, dt_current_time, user_id, con)
+    last_period = count_events(dt_current_time-delta, dt_current_time, user_id, con, index)
 
 
     print("\nevent count for previous period:")
-    prev_period = count_events(dt_current_time-2*delta, dt_current_time-delta, user_id, con)
+    prev_period = count_events(dt_current_time-2*delta, dt_current_time-delta, user_id, con, index)
 
     print("\ntype", "                   metric")
 
@@ -105,13 +110,13 @@ def past_behavior_delta(current_timestr, period_length, user_id, con):
     return result
 
 
-def past_behavior_alpha(current_timestr, period_length, user_id, con):
+def past_behavior_alpha(current_timestr, period_length, user_id, con, index=None):
     print('running version 5 of past_behavior')
     dt_current_time = datetime.strptime(current_timestr, format)
     delta = timedelta(days=period_length)
 
     print("\nFor user ", user_id)
     print("\nevent count for alpha period:")
-    last_period = count_events(dt_current_time-delta, dt_current_time, user_id, con)
+    last_period = count_events(dt_current_time-delta, dt_current_time, user_id, con, index)
     return last_period
 
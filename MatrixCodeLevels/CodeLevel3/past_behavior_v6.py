@@ -0,0 +1,275 @@
+"""
+Recent Past Behaviors analysis.  Version 6 of past_behavior.
+Count number of events of each type in any number of time windows ending
+before current time for a specific user, with a single range query over the
+event table for all the windows: each window's count is a sum over the rows
+in the union of the windows, grouped by type.  Adding a window costs one more
+sum, not one more scan.
+
+A window is (days_start, days_end): the events with created_at from
+days_start days up to (not including) days_end days before current time.
+past_behavior computes the delta metrics (last period against the previous
+period of equal length) and the alpha counts of version 5 from one query.
+
+past_behavior_batch computes them for all the agents of a round (which share
+the round's current time) at once: the agent ids are loaded into a temp table
+and joined to the event table in a single query grouped by
+"actor.login_h" and type, giving an (agents x 20) matrix of the 10 deltas
+and the 10 alphas, ready for feature_norm's normalize_deltas and
+normalize_alphas.
+
+In a working database (see working_db.py) the windows' bounds are integer
+seconds and the types their index in event_types.
+"""
+
+import numpy as np
+from datetime import datetime
+from datetime import timedelta
+from common import format
+from common import event_types
+from common import is_working_db
+from common import timestamp
+from feature_norm import type_position
+
+
+type_names = dict(enumerate(event_types))
+
+# temp table of the user ids counted by count_windows_batch's query
+batch_users_table = "create temp table if not exists batch_users (login_h text primary key)"
+
+
+# windows of past_behavior_delta and past_behavior_alpha
+def delta_windows(period_length):
+    return [(period_length, 0), (2 * period_length, period_length)]
+
+
+def alpha_windows(period_length):
+    return [(period_length, 0)]
+
+
+# window_bounds returns the (dtstr1, dtstr2) created_at bounds of each window
+# of windows ending before current_timestr.
+def window_bounds(current_timestr, windows):
+    dt_current_time = datetime.strptime(current_timestr, format)
+    return [((dt_current_time - timedelta(days=days_start)).strftime(format),
+             (dt_current_time - timedelta(days=days_end)).strftime(format))
+            for (days_start, days_end) in windows]
+
+
+# query_bounds returns bounds as compared with created_at in the event table:
+# integer seconds in a working database.
+def query_bounds(bounds, working_db):
+    if working_db:
+        return [(timestamp(dtstr1), timestamp(dtstr2)) for (dtstr1, dtstr2) in bounds]
+    return bounds
+
+
+# row_type returns the type name of an event row's type.
+def row_type(etype, working_db):
+    return type_names.get(etype) if working_db else etype
+
+
+# window_sums returns the select list of a sum for each window, and its
+# parameters.
+def window_sums(bounds):
+    sums = ", ".join("sum(case when created_at >= ? and created_at < ? then 1 else 0 end)"
+                     for window in bounds)
+    return (sums, [dtstr for window in bounds for dtstr in window])
+
+
+# union_bounds returns the created_at bounds of the union of the windows.
+def union_bounds(bounds):
+    return [min(dtstr1 for (dtstr1, dtstr2) in bounds),
+            max(dtstr2 for (dtstr1, dtstr2) in bounds)]
+
+
+# count_windows_query returns (sql, parameters) of count_windows's query of
+# the events of user_id (of all users, if user_id is "") in the windows with
+# db_bounds, the bounds as compared with created_at (see query_bounds).
+def count_windows_query(db_bounds, user_id):
+    (sums, params) = window_sums(db_bounds)
+
+    if user_id == "":
+        sql = f"""
+            select type, {sums}
+            from event
+            where (created_at >= ?)
+            and   (created_at <  ?)
+            group by type
+            """
+    else:
+        sql = f"""
+            select type, {sums}
+            from event
+            where "actor.login_h" = ?
+            and (created_at >= ?)
+            and (created_at <  ?)
+            group by type
+            """
+        params.append(user_id)
+
+    return (sql, params + union_bounds(db_bounds))
+
+
+# count_windows_batch_query returns (sql, parameters) of count_windows_batch's
+# query of the events of the users in temp.batch_users (see
+# batch_users_table) in the windows with db_bounds.  The users are matched
+# with "in" so that sqlite looks up each user's events in the event index
+# (with a join it may scan the whole index, or the event table to build a
+# bloom filter, for a few users).
+def count_windows_batch_query(db_bounds):
+    (sums, params) = window_sums(db_bounds)
+
+    sql = f"""
+        select "actor.login_h", type, {sums}
+        from event
+        where "actor.login_h" in (select login_h from temp.batch_users)
+        and (created_at >= ?)
+        and (created_at <  ?)
+        group by "actor.login_h", type
+        """
+
+    return (sql, params + union_bounds(db_bounds))
+
+
+# count_windows returns a list with, for each window of windows, the
+# dictionary of number of events of each type that occur in the window
+# for user_id.
+# If index (an EventCountIndex) contains user_id, the counts are looked
+# up in the index instead of queried from the event table.
+def count_windows(current_timestr, windows, user_id, con, index=None):
+
+    bounds = window_bounds(current_timestr, windows)
+
+    print(bounds)
+
+    timeA = datetime.now()
+
+    event_counts = [dict.fromkeys(event_types, 0) for window in windows]
+
+    if index is not None and user_id in index:
+        counts = index.count_seconds(query_bounds(bounds, True), user_id)
+        for event_count, window_counts in zip(event_counts, counts.tolist()):
+            event_count.update(zip(event_types, window_counts))
+    elif windows:
+        working_db = is_working_db(con)
+        (sql, params) = count_windows_query(query_bounds(bounds, working_db), user_id)
+
+        for row in con.execute(sql, params):
+            etype = row_type(row[0], working_db)
+            if etype in event_counts[0]:
+                for event_count, n in zip(event_counts, row[1:]):
+                    event_count[etype] = n
+
+    timeB = datetime.now()
+    print('\ntime in count_windows query=', str(timeB-timeA))
+
+    return event_counts
+
+
+# delta_metric returns the change of the number of events of each type
+# from prev_period to last_period.
+def delta_metric(last_period, prev_period):
+    result = {}
+
+    for etype in last_period.keys():
+        if prev_period[etype] > 0:
+            result[etype] = round(float(last_period[etype]) / prev_period[etype] - 1, 2)
+        else:
+            result[etype] = 0
+
+    return result
+
+
+# past_behavior returns (delta metrics over delta_period days, event counts
+# over alpha_period days) for user_id, from one count_windows query.
+def past_behavior(current_timestr, user_id, con, index=None, delta_period=14, alpha_period=60):
+    print('running version 6 of past_behavior')
+    print("\nFor user ", user_id)
+
+    (last_period, prev_period, alpha_counts) = count_windows(
+        current_timestr, delta_windows(delta_period) + alpha_windows(alpha_period),
+        user_id, con, index)
+
+    return (delta_metric(last_period, prev_period), alpha_counts)
+
+
+def past_behavior_delta(current_timestr, period_length, user_id, con, index=None):
+    (last_period, prev_period) = count_windows(current_timestr, delta_windows(period_length),
+                                               user_id, con, index)
+    return delta_metric(last_period, prev_period)
+
+
+def past_behavior_alpha(current_timestr, period_length, user_id, con, index=None):
+    (last_period,) = count_windows(current_timestr, alpha_windows(period_length),
+                                   user_id, con, index)
+    return last_period
+
+
+# count_windows_batch returns an int64 array of shape (len(user_ids),
+# len(windows), len(event_types)): the number of events of each type in
+# each window for each of user_ids.  The users in index (an
+# EventCountIndex) are counted from the index, the others with one query
+# joining a temp table of their ids to the event table.
+def count_windows_batch(current_timestr, windows, user_ids, con, index=None):
+
+    bounds = window_bounds(current_timestr, windows)
+
+    timeA = datetime.now()
+
+    event_counts = np.zeros((len(user_ids), len(windows), len(event_types)), dtype=np.int64)
+
+    index_bounds = query_bounds(bounds, True)  # in seconds, as the index counts them
+
+    rows = {}  # user_id -> rows of event_counts to query
+    for i, user_id in enumerate(user_ids):
+        if index is not None and user_id in index:
+            event_counts[i] = index.count_seconds(index_bounds, user_id)
+        else:
+            rows.setdefault(user_id, []).append(i)
+
+    if rows and windows:
+        con.execute(batch_users_table)
+        con.execute("delete from temp.batch_users")
+        con.executemany("insert into temp.batch_users values (?)",
+                        [(user_id,) for user_id in rows])
+        con.commit()  # so that no transaction holds the event table's snapshot
+
+        working_db = is_working_db(con)
+        (sql, params) = count_windows_batch_query(query_bounds(bounds, working_db))
+
+        for row in con.execute(sql, params):
+            user_id = row[0]
+            etype = row_type(row[1], working_db)
+            if etype in type_position:
+                for i in rows[user_id]:
+                    event_counts[i, :, type_position[etype]] = row[2:]
+
+    timeB = datetime.now()
+    print('\ntime in count_windows_batch query for', len(user_ids), 'users =', str(timeB-timeA))
+
+    return event_counts
+
+
+# past_behavior_batch returns an (agents x 20) float64 array with, for each
+# of user_ids, the delta metrics over delta_period days of each event type
+# (columns 0 to 9) and the event counts over alpha_period days (columns 10
+# to 19), as past_behavior returns them.
+def past_behavior_batch(current_timestr, user_ids, con, index=None, delta_period=14,
+                        alpha_period=60):
+    event_counts = count_windows_batch(
+        current_timestr, delta_windows(delta_period) + alpha_windows(alpha_period),
+        user_ids, con, index)
+    (last_period, prev_period, alpha_counts) = (event_counts[:, 0], event_counts[:, 1],
+                                                event_counts[:, 2])
+
+    n = len(event_types)
+    behavior = np.zeros((len(user_ids), 2 * n))
+
+    # rounded as delta_metric rounds them
+    for i, j in zip(*np.nonzero(prev_period)):
+        behavior[i, j] = round(float(last_period[i, j]) / int(prev_period[i, j]) - 1, 2)
+
+    behavior[:, n:] = alpha_counts
+
+    return behavior
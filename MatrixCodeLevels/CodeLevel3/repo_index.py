@@ -0,0 +1,191 @@
+"""
+Repo index.  The rowids of the repo_ext rows with valid features, so that an
+agent's random repo is chosen with a single draw instead of drawing rowids
+until one is found with a row and numeric features.
+
+The index is built with one scan of repo_ext and saved next to the database
+(<db>.repo_index.<max rowid>.npy), so later agent processes and runs only
+memory-map it.  Optionally the normalized features of every valid repo are
+kept too (<db>.repo_features.<max rowid>.npy), so that sampling a repo needs
+only the lookup of its full_name_h.
+"""
+
+import numpy as np
+from random import randrange
+from datetime import datetime
+from feature_norm import normalize_repo_counts
+from feature_norm import raw_feature_values
+from common import atomic_write
+
+
+repo_feature_names = ["watchers_count", "forks_count", "issue.open_count", "issue.total_count",
+                      "PendNbrs", "pendant", "inG2deg", "inG1deg", "pTiesIngG1", "ptiesingg2", "isHub"]
+
+# columns normalized as counts (with normalize_repo_counts); the others are
+# used as they are
+count_columns = normalize_repo_counts.columns(repo_feature_names)
+
+repo_columns = """watchers_count, forks_count, "issue.open_count", "issue.total_count",
+                  PendNbrs, pendant, inG2deg, inG1deg, pTiesIngG1, ptiesingg2, isHub"""
+
+# queries of RepoIndex.sample: the full_name_h (with preloaded features) or
+# the row of a repo by rowid
+sample_name_sql = "select full_name_h from repo_ext where rowid = ?"
+sample_row_sql = f"""
+    select full_name_h, {repo_columns}
+    from repo_ext
+    where rowid = ?
+    """
+
+# number of repo_ext rows normalized at once while building
+build_chunk = 100000
+
+
+class RepoIndexError(Exception):
+    pass
+
+
+# raw_repo_feature_values returns the features of a repo_ext row, before
+# normalization, as a list of floats.  Group role columns are 0 for a repo
+# not in the group_roles table (null values).  Raises an exception if the
+# row is invalid.
+def raw_repo_feature_values(row):
+    (watchers_count, forks_count, issue_open_count, issue_total_count,
+     PendNbrs, pendant, inG2deg, inG1deg, pTiesIngG1, ptiesingg2, isHub) = row
+
+    if issue_total_count == None:  # database contains some null values for issue_total_count
+        issue_total_count = issue_open_count
+
+    return raw_feature_values((watchers_count, forks_count, issue_open_count, issue_total_count),
+                              (PendNbrs, pendant, inG2deg, inG1deg, pTiesIngG1, ptiesingg2, isHub))
+
+
+# normalize_repo_features normalizes the count columns of an (repos x 11)
+# matrix of raw features in place and returns a mask of the valid rows (a
+# count that cannot be normalized, because it is negative, makes the row
+# invalid).
+def normalize_repo_features(raw):
+    raw[:, count_columns] = normalize_repo_counts(raw[:, count_columns])
+    return ~np.isnan(raw).any(axis=1)
+
+
+class RepoIndex:
+    """
+    Rowids (and optionally normalized features) of the valid repo_ext rows.
+    """
+
+    def __init__(self, rowids, features=None):
+        if len(rowids) == 0:
+            raise RepoIndexError("repo_ext has no rows with valid features")
+
+        self.rowids = rowids
+        self.features = features
+
+    def __len__(self):
+        return len(self.rowids)
+
+    @classmethod
+    def load_or_build(cls, con, event_db, with_features=False):
+        """
+        Memory-map the index saved for event_db, building and saving it first
+        if there is none for the current repo_ext.  The features are built
+        and saved only if with_features is set, so a run that preloads them
+        after runs that did not builds the features file then.
+        """
+
+        timeA = datetime.now()
+
+        (max_rowid,) = con.execute("select max(rowid) from repo_ext").fetchone()
+        rowids_file = f"{event_db}.repo_index.{max_rowid}.npy"
+        features_file = f"{event_db}.repo_features.{max_rowid}.npy"
+
+        rowids = load_array(rowids_file)
+        features = load_array(features_file) if with_features else None
+
+        if rowids is not None and (features is not None or not with_features):
+            index = cls(rowids, features)
+            print('\nloaded repo index of', len(index), 'repos in', str(datetime.now() - timeA))
+            return index
+
+        index = cls.build(con, with_features)
+        print('\nbuilt repo index of', len(index), 'repos in', str(datetime.now() - timeA))
+
+        if rowids is None:
+            atomic_write(rowids_file, lambda f: np.save(f, index.rowids), "repo index file")
+        if with_features:
+            atomic_write(features_file, lambda f: np.save(f, index.features), "repo index file")
+
+        return index
+
+    @classmethod
+    def build(cls, con, with_features=False):
+        """
+        Build the index with one scan of repo_ext.
+        """
+
+        cur = con.cursor()
+        cur.execute(f"""
+            select rowid, {repo_columns}
+            from repo_ext
+            """)
+
+        rowids = []
+        features = []
+
+        while True:
+            rows = cur.fetchmany(build_chunk)
+            if not rows:
+                break
+
+            chunk_rowids = []
+            raw = []
+            for row in rows:
+                try:
+                    raw.append(raw_repo_feature_values(row[1:]))
+                    chunk_rowids.append(row[0])
+                except:
+                    continue  # no valid features: never sampled
+
+            raw = np.array(raw, dtype=np.float64).reshape(-1, len(repo_feature_names))
+            valid = normalize_repo_features(raw)
+
+            rowids.append(np.array(chunk_rowids, dtype=np.int64)[valid])
+            if with_features:
+                features.append(raw[valid].astype(np.float32))
+
+        rowids = np.concatenate(rowids) if rowids else np.zeros(0, dtype=np.int64)
+        if with_features:
+            features = (np.concatenate(features) if features
+                        else np.zeros((0, len(repo_feature_names)), dtype=np.float32))
+        else:
+            features = None
+
+        return cls(rowids, features)
+
+    def sample(self, con):
+        """
+        Choose a valid repo at random.  Returns (rowid, repo_id, normalized
+        features).
+        """
+
+        i = randrange(len(self.rowids))
+        rowid = int(self.rowids[i])
+
+        if self.features is not None:
+            (repo_id,) = con.execute(sample_name_sql, (rowid,)).fetchone()
+            return (rowid, repo_id, self.features[i])
+
+        row = con.execute(sample_row_sql, (rowid,)).fetchone()
+
+        raw = np.array([raw_repo_feature_values(row[1:])])
+        normalize_repo_features(raw)
+        return (rowid, row[0], raw[0])
+
+
+# load_array memory-maps the array saved in path, or returns None if there
+# is none (or it is not a complete .npy file).
+def load_array(path):
+    try:
+        return np.load(path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
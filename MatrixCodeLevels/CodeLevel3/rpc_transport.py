@@ -0,0 +1,165 @@
+"""
+RPC Transport.  Encoding and framing of the JSON-RPC messages exchanged with
+the controller, used by RPCProxy and AsyncRPCProxy in multi_agent_v7.
+
+A transport is a codec and a framing:
+    codecs:    json     compact JSON (no spaces after separators)
+               msgpack  MessagePack (if the msgpack package is installed)
+    framings:  newline  each message followed by a newline (JSON only)
+               length   each message preceded by its length, a 4 byte
+                        big-endian unsigned int
+Request ids come from a counter instead of a new uuid per call.
+
+The default transport, JSON lines, is the one the controller speaks.  A more
+compact one is used only if negotiate_transport finds that the controller
+supports it.
+"""
+
+import json
+import struct
+import asyncio
+import itertools
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class RPCException(Exception):
+    pass
+
+
+class JSONCodec:
+    name = "json"
+
+    def encode(self, msg):
+        return json.dumps(msg, separators=(",", ":")).encode("ascii")
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+class MsgpackCodec:
+    name = "msgpack"
+
+    def encode(self, msg):
+        return msgpack.packb(msg, use_bin_type=True)
+
+    def decode(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+class NewlineFraming:
+    name = "newline"
+
+    def frame(self, payload):
+        return payload + b"\n"  # NOTE: The newline is important
+
+    def read(self, fobj):
+        line = fobj.readline()
+        return line if line else None
+
+    async def read_async(self, reader):
+        line = await reader.readline()
+        return line if line else None
+
+
+class LengthPrefixedFraming:
+    name = "length"
+    header = struct.Struct(">I")
+
+    def frame(self, payload):
+        return self.header.pack(len(payload)) + payload
+
+    def read(self, fobj):
+        header = fobj.read(self.header.size)
+        if len(header) < self.header.size:
+            return None
+
+        (length,) = self.header.unpack(header)
+        payload = fobj.read(length)
+        if len(payload) < length:
+            return None
+
+        return payload
+
+    async def read_async(self, reader):
+        try:
+            (length,) = self.header.unpack(await reader.readexactly(self.header.size))
+            return await reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            return None
+
+
+codecs = {"json": JSONCodec}
+if msgpack is not None:
+    codecs["msgpack"] = MsgpackCodec
+
+framings = {"newline": NewlineFraming, "length": LengthPrefixedFraming}
+
+
+class Transport:
+    """
+    Codec and framing of the messages of one controller connection.
+    """
+
+    def __init__(self, codec="json", framing="newline"):
+        if codec not in codecs:
+            raise ValueError(f"unknown or unavailable codec: {codec}")
+        if framing not in framings:
+            raise ValueError(f"unknown framing: {framing}")
+        if codec != "json" and framing == "newline":
+            raise ValueError(f"{codec} messages need length framing")
+
+        self.codec = codecs[codec]()
+        self.framing = framings[framing]()
+        self.ids = itertools.count(1)
+
+    def request(self, method, params):
+        """
+        Return (id, framed request) for a call of method with params.
+        """
+
+        msg = {
+            "jsonrpc": "2.0",
+            "id": next(self.ids),
+            "method": method,
+            "params": params
+        }
+        return (msg["id"], self.framing.frame(self.codec.encode(msg)))
+
+    def read_response(self, fobj):
+        """
+        Read and decode the next response from a binary file object, or
+        return None if the connection was closed.
+        """
+
+        payload = self.framing.read(fobj)
+        return self.codec.decode(payload) if payload != None else None
+
+    async def read_response_async(self, reader):
+        """
+        Read and decode the next response from an asyncio StreamReader, or
+        return None if the connection was closed.
+        """
+
+        payload = await self.framing.read_async(reader)
+        return self.codec.decode(payload) if payload != None else None
+
+
+# negotiate_transport offers the controller the codecs and framings
+# available here, most compact first, with call (the call method of a proxy
+# using the default transport), and returns the Transport for the codec and
+# framing it chooses.  If the controller does not implement
+# negotiate_transport (or chooses something not offered), the default
+# transport is kept.
+def negotiate_transport(call):
+    offered_codecs = [name for name in ("msgpack", "json") if name in codecs]
+    offered_framings = ["length", "newline"]
+
+    try:
+        ret = call("negotiate_transport", codecs=offered_codecs, framings=offered_framings)
+        return Transport(ret["codec"], ret["framing"])
+    except (RPCException, KeyError, TypeError, ValueError):
+        return Transport()
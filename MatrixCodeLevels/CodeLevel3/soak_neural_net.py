@@ -0,0 +1,72 @@
+"""
+Soak test of neural net inference memory use through c_code2.
+
+Runs n_inferences (default 1000000) forward-only inferences through
+runCommonNeuralNetInto with preallocated input and output buffers, then the
+same number through the string API runCommonNeuralNetForward, reporting the
+resident set size every report_every inferences.  Exits with status 1 if
+RSS grows by more than max_growth_mb (default 16) over either run after the
+first report, as it would if memory were allocated per inference.
+
+Usage:  python soak_neural_net.py [n_inferences [max_growth_mb]]
+"""
+
+import os
+import sys
+import numpy as np
+
+from _c_code2 import ffi, lib
+
+
+report_every = 100000
+
+
+def rss_mb():
+    # current (not peak) resident set size, from /proc on Linux
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def soak(label, n, run_one):
+    rss = []
+
+    for k in range(1, n + 1):
+        run_one()
+        if k % report_every == 0 or k == n:
+            rss.append(rss_mb())
+            print(f"{label}: {k} inferences, rss = {rss[-1]:.1f} MB")
+
+    return max(rss) - rss[0]
+
+
+def main(n, max_growth_mb):
+    lib.initCommonNeuralNet()
+
+    inputs = np.random.random_sample(lib.N_INPUTS).astype(np.float32)
+    outputs = np.zeros(lib.N_OUTPUTS, dtype=np.float32)
+    p_inputs = ffi.from_buffer("float[]", inputs)
+    p_outputs = ffi.from_buffer("float[]", outputs, require_writable=True)
+    instring = " ".join(str(x) for x in inputs).encode()
+
+    growth = {
+        "buffers": soak("buffers", n, lambda: lib.runCommonNeuralNetInto(p_inputs, p_outputs, 0)),
+        "string": soak("string", n, lambda: ffi.string(lib.runCommonNeuralNetForward(instring)))
+    }
+
+    failed = False
+    for label, growth_mb in growth.items():
+        print(f"{label}: rss grew {growth_mb:.1f} MB")
+        if growth_mb > max_growth_mb:
+            print(f"{label}: rss grew by more than {max_growth_mb} MB")
+            failed = True
+
+    return failed
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    max_growth_mb = float(sys.argv[2]) if len(sys.argv) > 2 else 16.0
+
+    if main(n, max_growth_mb):
+        sys.exit(1)
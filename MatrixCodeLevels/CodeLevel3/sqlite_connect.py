@@ -0,0 +1,253 @@
+"""
+SQLite connections.  ConnectionFactory opens the agents' connections to the
+event database (gh.sqlite) with the same options in every thread:
+
+    mode         "rw"         read-write, as sqlite3.connect(event_db)
+                 "ro"         read-only (file:...?mode=ro); still sees the
+                              rows the controller adds to the state store
+                 "immutable"  read-only without locking or change checks
+                              (file:...?immutable=1); only for a database
+                              nothing writes while it is open
+    mmap_size    bytes of the database file read through a memory map
+                 (pragma mmap_size) instead of read() calls
+    cache_size   pages (or -KiB, if negative) of the connection's page cache
+    temp_store   "memory" to keep temp tables and sorts in memory
+
+and optionally stages a copy of the database at startup with the SQLite
+backup API, which the connections then open in place of event_db:
+
+    stage        "memory"     one in-memory copy shared by the connections of
+                              the process (a shared cache memory database)
+                 "shm"        a copy in /dev/shm (tmpfs), shared by the agent
+                              processes and kept for later runs, named after
+                              the name, path, mtime and size of event_db
+
+A staged copy is a snapshot: like "immutable" it does not see the events
+registered during the run, so staging is for databases the controller does
+not write (a working database from working_db.py, or benchmarks).
+A copy holds the whole database, so stage a working database rather than the
+full store.  Staging event_db in /dev/shm removes its copies of earlier
+versions (and partial copies left by processes that died while staging);
+remove_staged_copies(event_db) removes them all, and so does
+    rm /dev/shm/<name of event_db>.*
+(tmpfs memory is only given back once no process has the copy open).
+
+Run this file to time each option on a database with the agents' queries:
+    python sqlite_connect.py gh.sqlite [--agents N]
+"""
+
+import os
+import re
+import sys
+import glob
+import zlib
+import sqlite3
+import argparse
+from pathlib import Path
+from datetime import datetime
+from repo_index import RepoIndex
+from user_features import load_user_features
+from past_behavior_v6 import past_behavior_batch
+
+
+shm_dir = "/dev/shm"
+
+
+class ConnectionFactory:
+    """
+    Connections to event_db (or its staged copy) with the given options.
+    """
+
+    def __init__(self, event_db, mode="rw", mmap_size=None, cache_size=None,
+                 temp_store=None, stage=None):
+        if mode not in ("rw", "ro", "immutable"):
+            raise ValueError(f"unknown mode {mode!r}")
+        if stage not in (None, "memory", "shm"):
+            raise ValueError(f"unknown stage {stage!r}")
+
+        self.event_db = str(event_db)
+        self.mode = mode
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.temp_store = temp_store
+        self.stage = stage
+
+        self.uri = source_uri(self.event_db, mode)
+        self.stage_con = None  # keeps the shared in-memory copy alive
+        self.staged = None     # path of the copy in shm_dir
+
+        if stage != None:
+            self.stage_db()
+
+    def stage_db(self):
+        timeA = datetime.now()
+
+        source = sqlite3.connect(source_uri(self.event_db, "ro"), uri=True)
+
+        if self.stage == "memory":
+            self.uri = f"file:event_db_{os.getpid()}_{id(self)}?mode=memory&cache=shared"
+            self.stage_con = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+            source.backup(self.stage_con)
+            source.close()
+            print('\nstaged', self.event_db, 'in memory in', str(datetime.now() - timeA))
+            return
+
+        st = os.stat(self.event_db)
+        staged = f"{staged_prefix(self.event_db)}{st.st_mtime_ns}.{st.st_size}"
+
+        if not os.path.exists(staged):
+            # written under a temporary name, so that other processes never
+            # open a partial copy
+            tmp = f"{staged}.{os.getpid()}.tmp"
+            target = sqlite3.connect(tmp)
+            source.backup(target)
+            target.close()
+            os.replace(tmp, staged)
+            print('\nstaged', self.event_db, 'to', staged, 'in', str(datetime.now() - timeA))
+        else:
+            print('\nusing staged copy', staged)
+
+        source.close()
+        remove_staged_copies(self.event_db, keep=staged)
+        self.staged = staged
+        self.uri = source_uri(staged, "immutable" if self.mode == "immutable" else "ro")
+
+    def connect(self, check_same_thread=True):
+        """
+        Open a connection and apply the pragmas.
+        """
+
+        con = sqlite3.connect(self.uri, uri=True, check_same_thread=check_same_thread)
+
+        if self.mmap_size != None:
+            con.execute(f"pragma mmap_size = {int(self.mmap_size)}")
+        if self.cache_size != None:
+            con.execute(f"pragma cache_size = {int(self.cache_size)}")
+        if self.temp_store != None:
+            con.execute(f"pragma temp_store = {self.temp_store}")
+
+        return con
+
+    def close(self):
+        if self.stage_con != None:
+            self.stage_con.close()
+            self.stage_con = None
+
+
+# staged_prefix returns the prefix of the names of the copies of event_db
+# staged in shm_dir: its name and a checksum of its absolute path, so that
+# databases of the same name in other directories are staged apart.
+def staged_prefix(event_db):
+    path = str(Path(event_db).absolute())
+    return os.path.join(shm_dir, f"{Path(path).name}.{zlib.crc32(path.encode()):08x}.")
+
+
+# names of the files of a staged copy after its prefix: <mtime>.<size>, or
+# <mtime>.<size>.<pid>.tmp (and its journal) while process pid writes it
+staged_name = re.compile(r"\d+\.\d+(\.(?P<pid>\d+)\.tmp(-journal)?)?")
+
+
+# remove_staged_copies removes the copies of event_db staged in shm_dir but
+# keep, and the partial copies of processes no longer running.  Returns the
+# paths removed.
+def remove_staged_copies(event_db, keep=None):
+    prefix = staged_prefix(event_db)
+    removed = []
+
+    for path in glob.glob(glob.escape(prefix) + "*"):
+        match = staged_name.fullmatch(path[len(prefix):])
+        if path == keep or match == None:
+            continue
+
+        if match["pid"] != None:
+            try:
+                os.kill(int(match["pid"]), 0)
+                continue  # still being written
+            except ProcessLookupError:
+                pass
+            except OSError:
+                continue
+
+        try:
+            os.remove(path)
+            removed.append(path)
+        except OSError:
+            continue
+
+    return removed
+
+
+# source_uri returns the URI opening path in mode.
+def source_uri(path, mode):
+    uri = Path(path).absolute().as_uri()
+    if mode == "ro":
+        return uri + "?mode=ro"
+    if mode == "immutable":
+        return uri + "?immutable=1"
+    return uri
+
+
+# tuned pragmas for the agents' read-mostly access
+tuned = {"mmap_size": 2 ** 30, "cache_size": -65536, "temp_store": "memory"}
+
+# (label, ConnectionFactory keyword arguments) of the options timed by the
+# benchmark
+options = [
+    ("rw", {}),
+    ("ro", {"mode": "ro"}),
+    ("ro + pragmas", dict(tuned, mode="ro")),
+    ("immutable + pragmas", dict(tuned, mode="immutable")),
+    ("memory", dict(tuned, stage="memory")),
+    ("shm", dict(tuned, stage="shm", mode="immutable"))
+]
+
+
+# time_queries runs the agents' queries for agent_ids on con: their user
+# features, past behavior counts at dt_str and a repo for each, as in a round.
+def time_queries(con, agent_ids, dt_str):
+    timeA = datetime.now()
+    load_user_features(con, agent_ids)
+    repo_index = RepoIndex.build(con)
+    for agent_id in agent_ids:
+        repo_index.sample(con)
+    past_behavior_batch(dt_str, agent_ids, con)
+    return (datetime.now() - timeA).total_seconds()
+
+
+def bench(event_db, num_agents, dt_str):
+    con = sqlite3.connect(event_db)
+    agent_ids = [user_id for (user_id,) in con.execute(
+        "select login_h from user_ext limit ?", (num_agents,))]
+    con.close()
+
+    print('\noption                  stage s  connect s   first s  second s')
+    for label, kwargs in options:
+        timeA = datetime.now()
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")  # the queries print as they go
+        try:
+            factory = ConnectionFactory(event_db, **kwargs)
+            timeB = datetime.now()
+            con = factory.connect()
+            timeC = datetime.now()
+            first = time_queries(con, agent_ids, dt_str)
+            second = time_queries(con, agent_ids, dt_str)
+            con.close()
+            factory.close()
+            if factory.staged != None:
+                remove_staged_copies(event_db)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+        print(f'{label:22s} {(timeB - timeA).total_seconds():8.3f} '
+              f'{(timeC - timeB).total_seconds():10.4f} {first:9.3f} {second:9.3f}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the connection options on a database.")
+    parser.add_argument("db")
+    parser.add_argument("--agents", type=int, default=1000)
+    parser.add_argument("--dt", default="2017-07-31T22:58:20Z")
+    args = parser.parse_args()
+    bench(args.db, args.agents, args.dt)
@@ -0,0 +1,143 @@
+"""
+SQLite Indexes.  Creates the indexes the agents' per-agent and per-round
+queries need on an event database (gh.sqlite), and checks with EXPLAIN QUERY
+PLAN that none of those queries scans a whole table (or a whole index, with
+a skip-scan or to build a bloom filter).
+
+The hot queries are the ones run for every agent or every round:
+    count_windows              event by "actor.login_h" and created_at range
+    count_windows_batch        event by each "actor.login_h" of a temp table
+                               and created_at range
+    EventCountIndex.add_user   event by "actor.login_h"
+    get_repo_quality           pr_state by "base.repo.full_name_h"
+    RepoQualityCache.get       pr_state by "base.repo.full_name_h"
+    FractionStatsCache.update  pr_state by "user.login_h" and by
+                               "base.repo.full_name_h", issue_state by
+                               "user.login_h", and rows added by rowid
+    load_user_features         user_ext by login_h
+    RepoIndex.sample           repo_ext by rowid
+The queries checked are built by the modules that run them, so the check
+follows any change to them.
+Queries that read a whole table on purpose (building the caches) are not
+checked.
+
+Usage:  python sqlite_indexes.py gh.sqlite          create indexes, then check
+        python sqlite_indexes.py gh.sqlite --check  only check
+Exits with status 1 if a hot query would scan a table.
+"""
+
+import sys
+import sqlite3
+from datetime import datetime
+from common import is_working_db
+from stats_cache import new_pr_rows_sql
+from stats_cache import new_issue_rows_sql
+from stats_cache import user_prs_sql
+from stats_cache import repo_prs_sql
+from stats_cache import user_issues_sql
+from stats_cache import repo_users_sql
+from get_repo_quality5 import repo_pr_users_sql
+from event_index import user_events_sql
+from user_features import user_features_sql
+from repo_index import sample_name_sql
+from repo_index import sample_row_sql
+from past_behavior_v6 import batch_users_table
+from past_behavior_v6 import count_windows_query
+from past_behavior_v6 import count_windows_batch_query
+from past_behavior_v6 import window_bounds
+from past_behavior_v6 import query_bounds
+from past_behavior_v6 import delta_windows
+from past_behavior_v6 import alpha_windows
+
+
+# (index name, table, columns); the event index covers the event queries,
+# so they are answered from the index alone
+indexes = [
+    ("event_actor_created_type", "event", '"actor.login_h", created_at, type'),
+    ("pr_state_repo_user", "pr_state", '"base.repo.full_name_h", "user.login_h"'),
+    ("pr_state_user", "pr_state", '"user.login_h"'),
+    ("issue_state_user", "issue_state", '"user.login_h"'),
+    ("user_ext_login", "user_ext", 'login_h')
+]
+
+# hot_queries returns (name, sql, parameters) of each hot query, with the
+# sql the agents run (on a working database, if working_db is set), with
+# the past behavior windows of past_behavior (the temp table of
+# count_windows_batch must exist).
+def hot_queries(working_db):
+    db_bounds = query_bounds(window_bounds("2017-07-31T22:58:20Z",
+                                           delta_windows(14) + alpha_windows(60)), working_db)
+
+    return [
+        ("count_windows",) + count_windows_query(db_bounds, "u"),
+        ("count_windows_batch",) + count_windows_batch_query(db_bounds),
+        ("EventCountIndex.add_user", user_events_sql(working_db), ("u",)),
+        ("get_repo_quality", repo_pr_users_sql, ("r",)),
+        ("RepoQualityCache.get", repo_users_sql, ("r",)),
+        ("FractionStatsCache.update users", user_prs_sql, ("u",)),
+        ("FractionStatsCache.update repos", repo_prs_sql, ("r",)),
+        ("FractionStatsCache.update issues", user_issues_sql, ("u",)),
+        ("FractionStatsCache.update new pr_state rows", new_pr_rows_sql, (0, 1)),
+        ("FractionStatsCache.update new issue_state rows", new_issue_rows_sql, (0, 1)),
+        ("load_user_features", user_features_sql(2), ("u", "v")),
+        ("RepoIndex.sample", sample_row_sql, (1,)),
+        ("RepoIndex.sample with features", sample_name_sql, (1,))
+    ]
+
+
+def create_indexes(con):
+    for name, table, columns in indexes:
+        timeA = datetime.now()
+        con.execute(f"create index if not exists {name} on {table} ({columns})")
+        print('index', name, 'on', table, 'ready in', str(datetime.now() - timeA))
+
+    timeA = datetime.now()
+    con.execute("analyze")
+    con.commit()
+    print('analyzed in', str(datetime.now() - timeA))
+
+
+# query_plan returns the detail lines of the query plan of sql.
+def query_plan(con, sql, params):
+    return [row[-1] for row in con.execute("explain query plan " + sql, params)]
+
+
+# full_scan returns True if a detail line of a query plan reads a whole table
+# or index: a full table scan, a scan of a whole index in place of the
+# table, a skip-scan of an index (ANY(...)) or a bloom filter, which is
+# built by reading the table.
+def full_scan(detail):
+    return detail.startswith("SCAN") or "ANY(" in detail or "BLOOM FILTER" in detail
+
+
+# check_query_plans prints the plan of each hot query and returns the names
+# of the queries that scan a table.
+def check_query_plans(con):
+    scans = []
+
+    con.execute(batch_users_table)
+
+    for name, sql, params in hot_queries(is_working_db(con)):
+        plan = query_plan(con, sql, params)
+        scanned = any(full_scan(detail) for detail in plan)
+        print('SCAN' if scanned else 'ok  ', name, ':', '; '.join(plan))
+        if scanned:
+            scans.append(name)
+
+    return scans
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(2)
+
+    con = sqlite3.connect(sys.argv[1])
+
+    if "--check" not in sys.argv[2:]:
+        create_indexes(con)
+
+    scans = check_query_plans(con)
+    if scans:
+        print('\nqueries that scan a table:', ', '.join(scans))
+        sys.exit(1)
@@ -0,0 +1,185 @@
+"""
+Stage Timers.  Times the stages of evaluating agents (user lookup, repo
+sampling, past behavior, repo quality, neural net call, event build) with
+time.perf_counter and aggregates each stage's times of a round into a
+histogram, for finding the stage that dominates a round at scale.
+
+Each time is added to a histogram of power of two buckets of microseconds:
+bucket 0 counts times under 1 us, bucket i times in [2**(i-1), 2**i) us.  A
+thread adds its times to its own histograms, so timing is not slowed down by
+a lock when agents are evaluated in a thread pool; emit() merges them at the
+end of the round.
+
+emit() writes one line per stage with the number of times, the total, the
+mean, approximate percentiles (the upper bound of the bucket they fall in)
+and the maximum, through logbook, or as JSON lines (with the histogram) to a
+metrics file.
+"""
+
+import json
+import time
+import threading
+import logbook
+
+
+num_buckets = 40   # up to 2**39 us, about 6 days
+
+_log = logbook.Logger(__name__)
+
+
+class Stage:
+    """
+    Context manager adding the time spent in its block to a stage.
+    """
+
+    __slots__ = ("timers", "name", "start")
+
+    def __init__(self, timers, name):
+        self.timers = timers
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timers.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class NoStage:
+    """
+    Context manager for stages that are not timed.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NoTimers:
+    """
+    StageTimers that time nothing, used when timing is off.
+    """
+
+    stage_context = NoStage()
+
+    def stage(self, name):
+        return self.stage_context
+
+    def add(self, name, seconds):
+        pass
+
+    def emit(self, round_num):
+        pass
+
+
+no_timers = NoTimers()
+
+
+class StageTimers:
+    """
+    Per-round histograms of the times of each stage.
+    """
+
+    def __init__(self, metrics_file=None, worker=0):
+        self.metrics_file = metrics_file
+        self.worker = worker
+        self.local = threading.local()
+        self.thread_stats = []  # the stats of every thread that added a time
+        self.lock = threading.Lock()
+
+    def stage(self, name):
+        """
+        Return a context manager timing its block as stage name.
+        """
+
+        return Stage(self, name)
+
+    def add(self, name, seconds):
+        stats = getattr(self.local, "stats", None)
+        if stats == None:
+            stats = self.local.stats = {}
+            with self.lock:
+                self.thread_stats.append(stats)
+
+        # [count, total seconds, max seconds, histogram]
+        stage_stats = stats.get(name)
+        if stage_stats == None:
+            stage_stats = stats[name] = [0, 0.0, 0.0, [0] * num_buckets]
+
+        stage_stats[0] += 1
+        stage_stats[1] += seconds
+        if seconds > stage_stats[2]:
+            stage_stats[2] = seconds
+        stage_stats[3][min(int(seconds * 1e6).bit_length(), num_buckets - 1)] += 1
+
+    def collect(self):
+        """
+        Merge and clear the stats of all threads.  Call between rounds, when
+        no thread is adding times.
+        """
+
+        merged = {}
+
+        with self.lock:
+            for stats in self.thread_stats:
+                for name, (count, total, longest, histogram) in stats.items():
+                    m = merged.setdefault(name, [0, 0.0, 0.0, [0] * num_buckets])
+                    m[0] += count
+                    m[1] += total
+                    m[2] = max(m[2], longest)
+                    m[3] = [a + b for a, b in zip(m[3], histogram)]
+                stats.clear()
+
+        return merged
+
+    def emit(self, round_num):
+        """
+        Write the round's stats of each stage and start the next round's.
+        """
+
+        records = []
+        for name, (count, total, longest, histogram) in self.collect().items():
+            records.append({
+                "round": round_num,
+                "worker": self.worker,
+                "stage": name,
+                "count": count,
+                "total_s": total,
+                "mean_us": 1e6 * total / count,
+                "p50_us": percentile(histogram, count, 0.50),
+                "p90_us": percentile(histogram, count, 0.90),
+                "p99_us": percentile(histogram, count, 0.99),
+                "max_us": 1e6 * longest,
+                "histogram": histogram[:max(i for i, n in enumerate(histogram) if n) + 1]
+            })
+
+        records.sort(key=lambda record: -record["total_s"])
+
+        if self.metrics_file != None:
+            with open(self.metrics_file, "a") as f:
+                for record in records:
+                    f.write(json.dumps(record, separators=(",", ":")) + "\n")
+            return
+
+        for record in records:
+            _log.info("round {} worker {} {}: {} in {:.3f} s, mean {:.1f} us, "
+                      "p50 {} us, p90 {} us, p99 {} us, max {:.1f} us",
+                      round_num, self.worker, record["stage"], record["count"],
+                      record["total_s"], record["mean_us"], record["p50_us"],
+                      record["p90_us"], record["p99_us"], record["max_us"])
+
+
+# percentile returns the upper bound in us of the histogram bucket the
+# fraction q of count times falls in.
+def percentile(histogram, count, q):
+    rank = q * count
+    seen = 0
+    for i, n in enumerate(histogram):
+        seen += n
+        if seen >= rank:
+            return 2 ** i
+    return 2 ** (len(histogram) - 1)
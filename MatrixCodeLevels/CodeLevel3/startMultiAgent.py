@@ -1,16 +1,37 @@
 from multiprocessing import Process
 from multi_agent_v7 import main_multi_agent
+from agent_scheduler import AgentScheduler
+from agent_ids import load_line_offsets
+from sqlite_connect import tuned
 
 if __name__ == '__main__':
-    starts = list(range(1, 2000, 1000))
+    num_procs = 2         # must match num_agent_procs in startController.sh
+    agent_ids_file = 'users2017'
+    first_agent = 1       # index in the agent ids file of the first agent
+    num_agents = 2000
+    chunk_size = 100      # agents handed to a process at a time
+
+    # the controller adds each round's events to the database, so it is
+    # opened read-only (not immutable or staged) with the tuned pragmas
+    db_options = dict(tuned, mode="ro")
+
+    # build the agent ids file's line offset index once, before the
+    # processes read their agents with it
+    load_line_offsets(agent_ids_file)
+
+    # all processes take chunks of the same agents from a shared scheduler
+    scheduler = AgentScheduler(num_agents, num_procs, chunk_size)
     procs = []
 
-    for start_index in starts:
+    for worker in range(num_procs):
         proc = Process(target=main_multi_agent,
-                       args= ('127.0.0.1:8090', '/home/ronmintz/MatrixCodeLevels/CodeLevel2/GitHubStore/gh_store2017ESX/gh.sqlite', 'users2017', start_index, 1000, 65131614))
+                       args= ('127.0.0.1:8090', '/home/ronmintz/MatrixCodeLevels/CodeLevel2/GitHubStore/gh_store2017ESX/gh.sqlite', agent_ids_file, first_agent, num_agents),
+                       kwargs={'scheduler': scheduler, 'worker': worker, 'pipelined': True,
+                               'db_options': db_options})
         procs.append(proc)
         proc.start()
 
     for proc in procs:
         proc.join()
-        
+
+    scheduler.report()
@@ -0,0 +1,385 @@
+"""
+Statistics Cache.  Keeps the fraction merged (for users and repos) and
+fraction of issues commented (for users) dictionaries of get_repo_quality5
+for the life of an agent process, instead of recomputing them with full scans
+of pr_state and issue_state every round.
+
+The dictionaries are computed once at startup, or loaded from a sidecar file
+next to the database if the database file still has the mtime and size it had
+when the sidecar was written.  After each round, update() recounts only the
+users and repos touched by the events registered in that round and by rows
+added to pr_state and issue_state since the last update (which also picks up
+rows from events registered by other agent processes).
+"""
+
+import os
+import pickle
+from datetime import datetime
+from common import atomic_write
+from get_repo_quality5 import tally_merged_for_users_and_repos
+from get_repo_quality5 import tally_commented_for_users
+from get_repo_quality5 import fraction_of_first_count
+
+
+# registered event types which can change pr_state or issue_state rows
+pr_event_types = {"PullRequestEvent", "PullRequestReviewCommentEvent"}
+issue_event_types = {"IssuesEvent", "IssueCommentEvent"}
+
+pr_columns = '"user.login_h", "base.repo.full_name_h", merged, created_at, merged_at'
+issue_columns = '"user.login_h", state, comments'
+
+# queries of FractionStatsCache.update: the rows added since the last
+# update, and then the rows of each user and repo they touch
+new_pr_rows_sql = """
+    select "user.login_h", "base.repo.full_name_h"
+    from pr_state
+    where rowid > ? and rowid <= ?
+    """
+new_issue_rows_sql = """
+    select "user.login_h"
+    from issue_state
+    where rowid > ? and rowid <= ?
+    """
+user_prs_sql = f"""
+    select {pr_columns}
+    from pr_state
+    where state = "closed" and "user.login_h" = ?
+    """
+repo_prs_sql = f"""
+    select {pr_columns}
+    from pr_state
+    where state = "closed" and "base.repo.full_name_h" = ?
+    """
+user_issues_sql = f"""
+    select {issue_columns}
+    from issue_state
+    where "user.login_h" = ?
+    """
+
+# query of RepoQualityCache.get: the users who made a pull request on a repo
+repo_users_sql = """
+    select distinct "user.login_h"
+    from pr_state
+    where "base.repo.full_name_h" = ?
+    """
+
+
+class FractionStatsCache:
+    """
+    Fraction merged and fraction commented dictionaries, with the counts
+    they are computed from.
+    """
+
+    def __init__(self, event_db):
+        self.event_db = str(event_db)
+        self.sidecar = self.event_db + ".stats.pickle"
+
+        # [merged count, non-merged count] and [twice commented count, other count]
+        self.user_merge_counts = {}
+        self.repo_merge_counts = {}
+        self.user_comment_counts = {}
+
+        self.fraction_merged_for_users = {}
+        self.fraction_merged_for_repos = {}
+        self.fraction_commented_for_users = {}
+
+        # highest rowids of pr_state and issue_state included in the counts
+        self.pr_rowid = 0
+        self.issue_rowid = 0
+
+        # users and repos touched by the events passed to note_events since
+        # the last update
+        self.noted_pr_users = set()
+        self.noted_pr_repos = set()
+        self.noted_issue_users = set()
+
+        # set by update(): the users whose fraction merged changed, and the
+        # repos whose pr_state rows may have changed
+        self.changed_merged_users = set()
+        self.touched_pr_repos = set()
+
+    def db_key(self):
+        st = os.stat(self.event_db)
+        return (st.st_mtime_ns, st.st_size)
+
+    def load_or_build(self, con):
+        """
+        Load the counts from the sidecar file if it matches the database,
+        otherwise compute them and write the sidecar file.
+        """
+
+        timeA = datetime.now()
+
+        if self.load():
+            print('\nloaded fraction statistics from', self.sidecar, 'in', str(datetime.now() - timeA))
+            return
+
+        self.build(con)
+        print('\ncomputed fraction statistics in', str(datetime.now() - timeA))
+        self.save()
+
+    def load(self):
+        try:
+            with open(self.sidecar, "rb") as f:
+                saved = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return False
+
+        if saved.get("db_key") != self.db_key():
+            return False
+
+        self.user_merge_counts = saved["user_merge_counts"]
+        self.repo_merge_counts = saved["repo_merge_counts"]
+        self.user_comment_counts = saved["user_comment_counts"]
+        self.pr_rowid = saved["pr_rowid"]
+        self.issue_rowid = saved["issue_rowid"]
+        self.compute_fractions()
+        return True
+
+    def save(self):
+        saved = {
+            "db_key": self.db_key(),
+            "user_merge_counts": self.user_merge_counts,
+            "repo_merge_counts": self.repo_merge_counts,
+            "user_comment_counts": self.user_comment_counts,
+            "pr_rowid": self.pr_rowid,
+            "issue_rowid": self.issue_rowid
+        }
+
+        atomic_write(self.sidecar,
+                     lambda f: pickle.dump(saved, f, protocol=pickle.HIGHEST_PROTOCOL),
+                     "fraction statistics file")
+
+    def build(self, con):
+        """
+        Compute all counts with one scan each of pr_state and issue_state.
+        """
+
+        cur = con.cursor()
+        self.pr_rowid = max_rowid(con, "pr_state")
+        self.issue_rowid = max_rowid(con, "issue_state")
+
+        self.user_merge_counts = {}
+        self.repo_merge_counts = {}
+        cur.execute(f"""
+            select {pr_columns}
+            from pr_state
+            where state = "closed" and rowid <= ?
+            """, (self.pr_rowid,))
+        tally_merged_for_users_and_repos(cur, self.user_merge_counts, self.repo_merge_counts)
+
+        self.user_comment_counts = {}
+        cur.execute(f"""
+            select {issue_columns}
+            from issue_state
+            where rowid <= ?
+            """, (self.issue_rowid,))
+        tally_commented_for_users(cur, self.user_comment_counts)
+
+        self.compute_fractions()
+
+    def compute_fractions(self):
+        self.fraction_merged_for_users = fractions(self.user_merge_counts)
+        self.fraction_merged_for_repos = fractions(self.repo_merge_counts)
+        self.fraction_commented_for_users = fractions(self.user_comment_counts)
+
+    def note_events(self, events):
+        """
+        Remember the users and repos touched by events (as sent to
+        register_events), to be recounted by the next update.
+        """
+
+        for event in events:
+            if event["type"] in pr_event_types:
+                self.noted_pr_users.add(event["actor"]["login_h"])
+                self.noted_pr_repos.add(event["repo"]["full_name_h"])
+            elif event["type"] in issue_event_types:
+                self.noted_issue_users.add(event["actor"]["login_h"])
+
+    def update(self, con, events=()):
+        """
+        Recount the users and repos touched by events (as sent to
+        register_events), by the events passed to note_events and by rows
+        added since the last update.
+        """
+
+        self.note_events(events)
+
+        pr_users = self.noted_pr_users
+        pr_repos = self.noted_pr_repos
+        issue_users = self.noted_issue_users
+
+        self.noted_pr_users = set()
+        self.noted_pr_repos = set()
+        self.noted_issue_users = set()
+
+        cur = con.cursor()
+
+        pr_rowid = max_rowid(con, "pr_state")
+        cur.execute(new_pr_rows_sql, (self.pr_rowid, pr_rowid))
+        for user, repo in cur:
+            pr_users.add(user)
+            pr_repos.add(repo)
+        self.pr_rowid = pr_rowid
+
+        issue_rowid = max_rowid(con, "issue_state")
+        cur.execute(new_issue_rows_sql, (self.issue_rowid, issue_rowid))
+        for (user,) in cur:
+            issue_users.add(user)
+        self.issue_rowid = issue_rowid
+
+        # rows with a null user or repo are only counted by a full build
+        pr_users.discard(None)
+        pr_repos.discard(None)
+        issue_users.discard(None)
+
+        self.changed_merged_users = set()
+        self.touched_pr_repos = pr_repos
+
+        for user in pr_users:
+            cur.execute(user_prs_sql, (user,))
+            if self.recount(cur, user, self.user_merge_counts, self.fraction_merged_for_users,
+                            lambda rows, data: tally_merged_for_users_and_repos(rows, data, {})):
+                self.changed_merged_users.add(user)
+
+        for repo in pr_repos:
+            cur.execute(repo_prs_sql, (repo,))
+            self.recount(cur, repo, self.repo_merge_counts, self.fraction_merged_for_repos,
+                         lambda rows, data: tally_merged_for_users_and_repos(rows, {}, data))
+
+        for user in issue_users:
+            cur.execute(user_issues_sql, (user,))
+            self.recount(cur, user, self.user_comment_counts, self.fraction_commented_for_users,
+                         tally_commented_for_users)
+
+    # recount replaces the counts and fraction of key with those tallied from
+    # rows, and returns True if the fraction changed.
+    def recount(self, rows, key, counts, fraction_for, tally):
+        data = {}
+        tally(rows, data)
+
+        counts.pop(key, None)
+        old_fraction = fraction_for.pop(key, None)
+
+        if key in data:
+            counts[key] = data[key]
+            fraction = fraction_of_first_count(data[key])
+            if fraction is not None:
+                fraction_for[key] = fraction
+
+        return fraction_for.get(key) != old_fraction
+
+
+def max_rowid(con, table):
+    (rowid,) = con.execute(f"select max(rowid) from {table}").fetchone()
+    return rowid or 0
+
+
+def fractions(counts):
+    fraction_for = {}
+
+    for key, key_counts in counts.items():
+        fraction = fraction_of_first_count(key_counts)
+        if fraction is not None:
+            fraction_for[key] = fraction
+
+    return fraction_for
+
+
+class RepoQualityCache:
+    """
+    get_repo_quality for every repo in pr_state, computed with one grouped
+    pass over pr_state.  When the fraction merged of a repo's user changes,
+    or the repo's pr_state rows change, the repo's quality is dropped and
+    recomputed (with get_repo_quality's query) the next time it is needed.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats      # the FractionStatsCache with fraction_merged_for_users
+        self.quality = {}       # quality of each repo with pull requests
+        self.stale = set()      # repos whose quality must be recomputed
+        self.repos_of_user = {} # repos each user made a pull request on
+
+    def build(self, con):
+        timeA = datetime.now()
+
+        fraction_for = self.stats.fraction_merged_for_users
+        self.quality = {}
+        self.stale = set()
+        self.repos_of_user = {}
+
+        cur = con.cursor()
+        cur.execute("""
+            select "base.repo.full_name_h", "user.login_h"
+            from pr_state
+            group by "base.repo.full_name_h", "user.login_h"
+            """)
+
+        repo_id = None
+        sum_quality = 0.0
+        n = 0
+
+        # rows come grouped by repo: each repo's users are consecutive
+        for row_repo_id, user in cur:
+            if row_repo_id != repo_id:
+                if n > 0:
+                    self.quality[repo_id] = sum_quality / n
+                repo_id = row_repo_id
+                sum_quality = 0.0
+                n = 0
+
+            if repo_id is None:
+                continue  # get_repo_quality finds no rows for a null repo
+
+            self.repos_of_user.setdefault(user, []).append(repo_id)
+            sum_quality += fraction_for.get(user, 0.0)  # 0 if user has no closed pull requests
+            n += 1
+
+        if n > 0:
+            self.quality[repo_id] = sum_quality / n
+
+        print('\ncomputed quality of', len(self.quality), 'repos in', str(datetime.now() - timeA))
+
+    def invalidate(self):
+        """
+        Drop the qualities changed by the last FractionStatsCache.update().
+        """
+
+        for user in self.stats.changed_merged_users:
+            self.stale.update(self.repos_of_user.get(user, ()))
+
+        self.stale.update(self.stats.touched_pr_repos)
+
+        for repo_id in self.stale:
+            self.quality.pop(repo_id, None)
+
+    def get(self, con, repo_id):
+        if repo_id in self.quality:
+            return self.quality[repo_id]
+
+        if repo_id not in self.stale:
+            return 0.0  # no pull requests on this repo
+
+        fraction_for = self.stats.fraction_merged_for_users
+        cur = con.cursor()
+        cur.execute(repo_users_sql, (repo_id,)) # get all users who made a PR on this repo
+
+        sum_quality = 0.0
+        n = 0
+
+        for (user,) in cur:
+            repos = self.repos_of_user.setdefault(user, [])
+            if repo_id not in repos:
+                repos.append(repo_id)
+
+            sum_quality += fraction_for.get(user, 0.0)
+            n += 1
+
+        if n > 0:
+            repo_quality = sum_quality / n
+        else:
+            repo_quality = 0.0
+
+        self.quality[repo_id] = repo_quality
+        self.stale.discard(repo_id)
+        return repo_quality
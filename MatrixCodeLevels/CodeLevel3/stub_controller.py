@@ -0,0 +1,225 @@
+"""
+Stub Controller.  A local stand-in for the matrix controller started by
+startController.sh, for running and benchmarking rounds of agent processes
+on one machine.
+
+It speaks the same newline-delimited JSON-RPC and implements:
+    can_we_start_yet       answers with the round number and its start and
+                           end times once every agent process has registered
+                           its events for the previous round (round 0 once
+                           all num_agent_procs processes have asked), and
+                           with round -1 after num_rounds rounds
+    register_events        takes a process's (last) events of the round
+    register_events_chunk  takes some of a process's events of the round
+    negotiate_transport    chooses the first codec and framing offered that
+                           rpc_transport supports
+If a state store is given, registered events are added to its event table
+(the real store also updates pr_state and issue_state; the stub does not),
+with integer types and times if it is a working database (see working_db.py).
+
+After the last round it prints, for each round, the number of events, the
+round's wall time (from starting the round to the last register_events) and
+the events (scored agents) per second, and then the mean time taken to
+handle each method.
+
+Usage:  python stub_controller.py [-p port] [-n num_agent_procs]
+            [-r num_rounds] [-t start_time] [-q round_time] [-s state_store]
+"""
+
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+
+from common import event_types
+from common import is_working_db
+from common import timestamp
+from rpc_transport import Transport
+from rpc_transport import codecs as transport_codecs
+from rpc_transport import framings as transport_framings
+
+
+class StubController:
+    """
+    Rounds of num_agent_procs agent processes.
+    """
+
+    def __init__(self, num_agent_procs, num_rounds, start_time, round_time, state_store=None):
+        self.num_agent_procs = num_agent_procs
+        self.num_rounds = num_rounds
+        self.start_time = start_time
+        self.round_time = round_time
+        self.state_store = state_store
+
+        self.cond = threading.Condition()
+        self.asked = 0          # processes that asked to start round 0
+        self.registered = {}    # round -> processes that registered their events
+        self.round_started = {} # round -> perf_counter when it started
+        self.round_ended = {}   # round -> perf_counter of its last register_events
+        self.round_events = {}  # round -> number of events registered
+        self.method_seconds = {}  # method -> [calls, seconds handling them]
+        self.finished = 0       # processes told that the simulation is over
+        self.listening = threading.Event()
+        self.done = threading.Event()
+
+        self.store = sqlite3.connect(state_store, check_same_thread=False) if state_store else None
+        self.store_lock = threading.Lock()
+        self.working_db = self.store != None and is_working_db(self.store)
+
+    def serve(self, port, host="127.0.0.1"):
+        """
+        Accept agent connections until every process has been told that the
+        simulation is over.  The port listened on (chosen by the system if
+        port is 0) is self.port once self.listening is set.
+        """
+
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((host, port))
+            server.listen(64)
+            server.settimeout(0.5)
+            self.port = server.getsockname()[1]
+            self.listening.set()
+            print('stub controller listening on', f'{host}:{self.port}')
+
+            while not self.done.is_set():
+                try:
+                    (sock, addr) = server.accept()
+                except socket.timeout:
+                    continue
+                threading.Thread(target=self.handle, args=(sock,), daemon=True).start()
+
+    def handle(self, sock):
+        transport = Transport()
+        fobj = sock.makefile(mode="rb")
+        cur_round = 0   # round this connection's process is in
+
+        with sock:
+            while True:
+                request = transport.read_response(fobj)  # a request, decoded like a response
+                if request == None:
+                    return
+
+                timeA = time.perf_counter()
+                method = request.get("method")
+                params = request.get("params", {})
+                next_transport = None
+
+                if method == "can_we_start_yet":
+                    result = self.can_we_start_yet(cur_round)
+                    timeA = time.perf_counter()  # waiting for the round is not handling time
+                elif method == "register_events":
+                    result = self.register_events(cur_round, params.get("events", []), last=True)
+                    cur_round += 1
+                elif method == "register_events_chunk":
+                    result = self.register_events(cur_round, params.get("events", []), last=False)
+                elif method == "negotiate_transport":
+                    result = self.negotiate_transport(params)
+                    next_transport = Transport(result["codec"], result["framing"])
+                else:
+                    result = None
+
+                if method in ("can_we_start_yet", "register_events", "register_events_chunk",
+                              "negotiate_transport"):
+                    response = {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+                else:
+                    response = {"jsonrpc": "2.0", "id": request.get("id"),
+                                "error": {"code": -32601, "message": "Method not found"}}
+
+                sock.sendall(transport.framing.frame(transport.codec.encode(response)))
+
+                with self.cond:
+                    calls = self.method_seconds.setdefault(method, [0, 0.0])
+                    calls[0] += 1
+                    calls[1] += time.perf_counter() - timeA
+
+                    if method == "can_we_start_yet" and result["cur_round"] == -1:
+                        self.finished += 1
+                        if self.finished == self.num_agent_procs:
+                            self.done.set()
+
+                if next_transport != None:
+                    transport = next_transport
+
+    def can_we_start_yet(self, cur_round):
+        with self.cond:
+            if cur_round == 0:
+                self.asked += 1
+                self.cond.notify_all()
+                self.cond.wait_for(lambda: self.asked >= self.num_agent_procs)
+            else:
+                self.cond.wait_for(lambda: self.registered.get(cur_round - 1, 0) >= self.num_agent_procs)
+
+            if cur_round >= self.num_rounds:
+                return {"cur_round": -1, "start_time": 0, "end_time": 0}
+
+            self.round_started.setdefault(cur_round, time.perf_counter())
+
+        start_time = self.start_time + cur_round * self.round_time
+        return {"cur_round": cur_round, "start_time": start_time,
+                "end_time": start_time + self.round_time}
+
+    def register_events(self, cur_round, events, last):
+        if self.store != None and events and self.working_db:
+            with self.store_lock:
+                self.store.executemany(
+                    'insert into event (type, "actor.login_h", created_at) values (?,?,?)',
+                    [(event_types.index(event["type"]), event["actor"]["login_h"],
+                      timestamp(event["created_at"])) for event in events])
+                self.store.commit()
+        elif self.store != None and events:
+            with self.store_lock:
+                self.store.executemany(
+                    'insert into event (id_h, type, "actor.login_h", "repo.full_name_h", created_at) '
+                    'values (?,?,?,?,?)',
+                    [(event["id_h"], event["type"], event["actor"]["login_h"],
+                      event["repo"]["full_name_h"], event["created_at"]) for event in events])
+                self.store.commit()
+
+        with self.cond:
+            self.round_events[cur_round] = self.round_events.get(cur_round, 0) + len(events)
+            if last:
+                self.registered[cur_round] = self.registered.get(cur_round, 0) + 1
+                if self.registered[cur_round] == self.num_agent_procs:
+                    self.round_ended[cur_round] = time.perf_counter()
+                self.cond.notify_all()
+
+        return True
+
+    def negotiate_transport(self, params):
+        codec = next(c for c in params.get("codecs", []) + ["json"] if c in transport_codecs)
+        framing = next(f for f in params.get("framings", []) + ["newline"] if f in transport_framings)
+        if codec != "json":
+            framing = "length"
+        return {"codec": codec, "framing": framing}
+
+    def report(self):
+        print('\nround     events    seconds   events/s')
+        for r in sorted(self.round_ended):
+            seconds = self.round_ended[r] - self.round_started[r]
+            events = self.round_events.get(r, 0)
+            print(f'{r:5d} {events:10d} {seconds:10.3f} {events / seconds if seconds > 0 else 0.0:10.1f}')
+
+        print('\nmethod                     calls   mean ms')
+        for method, (calls, seconds) in sorted(self.method_seconds.items(), key=lambda m: str(m[0])):
+            print(f'{str(method):25s} {calls:7d} {1000 * seconds / calls:9.3f}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the matrix controller.")
+    parser.add_argument("-p", "--port", type=int, default=8090)
+    parser.add_argument("-n", "--num-agent-procs", type=int, default=2)
+    parser.add_argument("-r", "--num-rounds", type=int, default=3)
+    parser.add_argument("-t", "--start-time", type=int, default=1501541900)
+    parser.add_argument("-q", "--round-time", type=int, default=3600)
+    parser.add_argument("-s", "--state-store", default=None)
+    args = parser.parse_args()
+
+    controller = StubController(args.num_agent_procs, args.num_rounds, args.start_time,
+                                args.round_time, args.state_store)
+    timeA = datetime.now()
+    controller.serve(args.port)
+    print('\nall rounds done in', str(datetime.now() - timeA))
+    controller.report()
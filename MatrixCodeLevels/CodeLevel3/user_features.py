@@ -0,0 +1,92 @@
+"""
+User features.  The ten user_ext features of an agent (public_repos,
+followers, following and the group role columns), normalized for the neural
+net.  They do not change during a simulation, so an agent process loads them
+once for all of its agents instead of querying user_ext for every agent
+every round.
+"""
+
+import numpy as np
+from datetime import datetime
+from feature_norm import normalize_user_counts
+from feature_norm import raw_feature_values
+
+
+user_feature_names = ["public_repos", "followers", "following",
+                      "PendNbrs", "pendant", "inG2deg", "inG1deg", "pTiesIngG1", "ptiesingg2", "isHub"]
+
+# one record per agent: its normalized features, and whether its user_ext
+# row was found and valid (agents without valid features are skipped)
+user_feature_dtype = np.dtype([("features", np.float32, (len(user_feature_names),)),
+                               ("valid", np.bool_)])
+
+user_columns = """public_repos, followers, following,
+                  PendNbrs, pendant, inG2deg, inG1deg, pTiesIngG1, ptiesingg2, isHub"""
+
+# columns normalized as counts (with normalize_user_counts); the others are
+# used as they are
+count_columns = normalize_user_counts.columns(user_feature_names)
+
+# number of login_h values per user_ext query
+query_chunk = 500
+
+
+# raw_user_feature_values returns the features of a user_ext row, before
+# normalization, as a list of floats.  Group role columns are 0 for a user
+# not in the group_roles table (null values).  Raises an exception if the
+# row is invalid.
+def raw_user_feature_values(row):
+    (public_repos, followers, following,
+     PendNbrs, pendant, inG2deg, inG1deg, pTiesIngG1, ptiesingg2, isHub) = row
+
+    return raw_feature_values((public_repos, followers, following),
+                              (PendNbrs, pendant, inG2deg, inG1deg, pTiesIngG1, ptiesingg2, isHub))
+
+
+# user_features_sql returns the query of the user_ext rows of n login_h
+# values.
+def user_features_sql(n):
+    return f"""
+        select login_h, {user_columns}
+        from user_ext
+        where login_h in ({",".join("?" * n)})
+        order by rowid
+        """
+
+
+# load_user_features returns a user_feature_dtype array with one record for
+# each of agent_ids, in the same order.
+def load_user_features(con, agent_ids):
+    timeA = datetime.now()
+
+    rows = {}
+    cur = con.cursor()
+
+    for start in range(0, len(agent_ids), query_chunk):
+        chunk = agent_ids[start:start + query_chunk]
+        cur.execute(user_features_sql(len(chunk)), chunk)
+
+        for row in cur:
+            rows.setdefault(row[0], row[1:])  # first row for the user
+
+    user_features = np.zeros(len(agent_ids), dtype=user_feature_dtype)
+    raw = np.zeros((len(agent_ids), len(user_feature_names)))
+
+    for i, agent_id in enumerate(agent_ids):
+        try:
+            raw[i] = raw_user_feature_values(rows[agent_id])
+            user_features["valid"][i] = True
+        except:
+            continue  # no row or invalid data: the agent is skipped
+
+    # all agents' counts normalized at once; a count that cannot be
+    # normalized (negative) makes the agent's features invalid
+    raw[:, count_columns] = normalize_user_counts(raw[:, count_columns])
+    user_features["valid"] &= ~np.isnan(raw).any(axis=1)
+    user_features["features"] = np.where(user_features["valid"][:, None], raw, 0.0)
+
+    timeB = datetime.now()
+    print('\nloaded user features of', int(user_features["valid"].sum()), 'of',
+          len(agent_ids), 'agents in', str(timeB-timeA))
+
+    return user_features
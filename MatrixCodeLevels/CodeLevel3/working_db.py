@@ -0,0 +1,183 @@
+"""
+Working database.  Extracts from the GitHub store (gh.sqlite) only the tables
+and columns the agents read into a compact, indexed working database for a
+simulation run, so that every agent process maps and scans much less:
+
+    event        type (the index of the type in event_types),
+                 "actor.login_h", created_at (integer seconds since the epoch)
+    user_ext     login_h and the ten user features, as reals
+    repo_ext     full_name_h and the eleven repo features, as reals
+    pr_state     "user.login_h", "base.repo.full_name_h", state, merged (0 or
+                 1), created_at and merged_at (integer seconds, or null)
+    issue_state  "user.login_h", state, comments (integer, or null)
+
+Only rows the agents can use are kept: events of the ten event types with a
+created_at in the store's format, and for each user (and repo) its first
+user_ext (repo_ext) row if its features are valid.  Values are converted as
+the agents' readers convert them, so the features, past behavior counts and
+fraction statistics computed from the working database are those of the
+store (but for events with a malformed created_at, which the store's string
+comparisons may count).  The indexes of sqlite_indexes.py are created on it.
+
+The working database is marked with common.working_db_id (pragma
+application_id), which tells past_behavior_v6, EventCountIndex and the
+stub controller that its types and times are integers.  It is a snapshot:
+the controller writes each round's events to the store, not to the working
+database, so past behavior counted from it leaves out the events registered
+during the run (except for the agents in an EventCountIndex).  Open it
+immutable, or stage it in /dev/shm (see sqlite_connect.py).
+
+Usage:  python working_db.py gh.sqlite working.sqlite
+"""
+
+import os
+import sys
+import sqlite3
+from datetime import datetime
+from common import event_types
+from common import working_db_id
+from common import timestamp_sql
+from common import type_index_sql
+from user_features import raw_user_feature_values
+from user_features import user_columns
+from repo_index import raw_repo_feature_values
+from repo_index import repo_columns
+from sqlite_connect import source_uri
+from sqlite_indexes import create_indexes
+from sqlite_indexes import check_query_plans
+
+
+# rows converted and inserted at once
+insert_chunk = 100000
+
+
+def create_tables(con):
+    con.executescript("""
+        create table event (type integer, "actor.login_h" text, created_at integer);
+        create table user_ext (login_h text, public_repos real, followers real,
+                               following real, PendNbrs real, pendant real, inG2deg real,
+                               inG1deg real, pTiesIngG1 real, ptiesingg2 real, isHub real);
+        create table repo_ext (full_name_h text, watchers_count real, forks_count real,
+                               "issue.open_count" real, "issue.total_count" real,
+                               PendNbrs real, pendant real, inG2deg real, inG1deg real,
+                               pTiesIngG1 real, ptiesingg2 real, isHub real);
+        create table pr_state ("user.login_h" text, "base.repo.full_name_h" text,
+                               state text, merged integer, created_at integer,
+                               merged_at integer);
+        create table issue_state ("user.login_h" text, state text, comments integer);
+        """)
+
+
+# truthy and to_int convert values as the readers do (if merged: and
+# int(comments)), for SQL.
+def truthy(value):
+    return 1 if value else 0
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except:
+        return None  # not counted by tally_commented_for_users either
+
+
+# copy_features copies the first row of each key of the store's table with
+# valid features (raw_values does not raise) to con, as reals.
+def copy_features(con, table, key, columns, raw_values):
+    cur = con.execute(f"""
+        select {key}, {columns}
+        from store.{table}
+        order by rowid
+        """)
+
+    seen = set()
+    while True:
+        rows = cur.fetchmany(insert_chunk)
+        if not rows:
+            break
+
+        values = []
+        for row in rows:
+            if row[0] in seen:
+                continue
+            seen.add(row[0])
+
+            try:
+                values.append([row[0]] + raw_values(row[1:]))
+            except:
+                continue  # no valid features: never used
+
+        if values:
+            con.executemany(f"insert into main.{table} values ({','.join('?' * len(values[0]))})",
+                            values)
+
+
+def make_working_db(store, path):
+    timeA = datetime.now()
+
+    con = sqlite3.connect(path, uri=True)
+    con.create_function("truthy", 1, truthy, deterministic=True)
+    con.create_function("to_int", 1, to_int, deterministic=True)
+    con.execute("pragma journal_mode = off")
+    con.execute("pragma synchronous = off")
+    create_tables(con)
+    con.execute("attach database ? as store", (source_uri(store, "ro"),))
+
+    steps = [
+        ("event", f"""
+            insert into main.event
+            select {type_index_sql('type')}, "actor.login_h", {timestamp_sql('created_at')}
+            from store.event
+            where type in ({",".join(f"'{etype}'" for etype in event_types)})
+            and {timestamp_sql('created_at')} is not null
+            """),
+        ("pr_state", f"""
+            insert into main.pr_state
+            select "user.login_h", "base.repo.full_name_h", state, truthy(merged),
+            {timestamp_sql('created_at')}, {timestamp_sql('merged_at')}
+            from store.pr_state
+            order by rowid
+            """),
+        ("issue_state", """
+            insert into main.issue_state
+            select "user.login_h", state, to_int(comments)
+            from store.issue_state
+            order by rowid
+            """)
+    ]
+
+    for table, sql in steps:
+        timeB = datetime.now()
+        con.execute(sql)
+        con.commit()
+        print('copied', table, 'in', str(datetime.now() - timeB))
+
+    timeB = datetime.now()
+    copy_features(con, "user_ext", "login_h", user_columns, raw_user_feature_values)
+    copy_features(con, "repo_ext", "full_name_h", repo_columns, raw_repo_feature_values)
+    con.commit()
+    print('copied user_ext and repo_ext in', str(datetime.now() - timeB))
+
+    con.execute("detach database store")
+    con.execute(f"pragma application_id = {working_db_id}")
+    create_indexes(con)
+    scans = check_query_plans(con)
+
+    con.close()
+
+    print(f"\nwrote {path} ({os.path.getsize(path) / 2**20:.1f} MiB) from {store} "
+          f"({os.path.getsize(store) / 2**20:.1f} MiB) in", str(datetime.now() - timeA))
+    return scans
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(2)
+
+    if os.path.exists(sys.argv[2]):
+        print(f"{sys.argv[2]} already exists")
+        sys.exit(2)
+
+    if make_working_db(sys.argv[1], sys.argv[2]):
+        sys.exit(1)